@@ -1,19 +1,37 @@
 from typing import Union
+from contextlib import contextmanager
+from itertools import islice
+import re
 import warnings
+import weakref
 import psutil
+import peewee as pv
 from time import time
 import tinydb as tdb
 from tinydb.storages import MemoryStorage
 
 from . import anki_db
+from .anki_util import field_checksum, stripHTMLMedia
+from .batch import DEFAULT_BATCH_SIZE, SQLITE_MAX_VARIABLE_NUMBER, iter_keyset, insert_chunked, select_by_ids, \
+    update_by_ids, chunked_ids, executemany
+from .checkpoint import Checkpoints, new_digest, row_digest
+from .col_cache import ColCache
+from .pragmas import PragmaProfiles
 from .dir import get_collection_path
+from .fts import FullTextIndex
 from .builder.models import ModelBuilder, FieldBuilder
 from .builder.decks import DeckBuilder, DConfBuilder
 from .builder.notes import NoteBuilder, CardBuilder
+from .builder.guid import guid_for
+from .records import NoteRecord
+from .schedule import validate_schedule
+from .search import SearchCompiler
+from .tags import TagIndex
+from .upsert import UpsertIndex
 
 
 class Anki:
-    def __init__(self, anki2_path=None, disallow_unsafe: Union[bool, None]=False, **kwargs):
+    def __init__(self, anki2_path=None, disallow_unsafe: Union[bool, None]=False, profile='default', **kwargs):
         if anki2_path is None:
             anki2_path = get_collection_path(account_name=kwargs.setdefault('account_name', None))
             try:
@@ -23,63 +41,134 @@ class Anki:
                 warnings.warn(e)
             kwargs.pop('account_name')
 
-        anki_db.database.init(anki2_path, pragmas={
+        self.db = anki_db.ModelSet(pv.SqliteDatabase(anki2_path, pragmas={
             'foreign_keys': 0
-        }, **kwargs)
+        }, **kwargs))
 
+        self.anki2_path = anki2_path
         self.disallow_unsafe = disallow_unsafe
 
+        self.col_cache = ColCache(self.db)
+        self.upsert_index = UpsertIndex(self)
+        self.tag_index = TagIndex(self)
+        self.search = SearchCompiler(self)
+        self.fts = None
+        self.checkpoints = Checkpoints(self.db, '{}.checkpoints'.format(anki2_path))
+
+        self.pragmas = PragmaProfiles(self.db)
+        # Restores the pragmas and indexes if the instance is garbage-collected, or the interpreter exits, unclosed
+        self._restore_pragmas = weakref.finalize(self, self.pragmas.apply, 'default')
+        if profile != 'default':
+            self.pragmas.apply(profile)
+
         self.tdb = tdb.TinyDB(storage=MemoryStorage)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
+        self.close()
+
+    def close(self):
+        """
+        Restore the pragmas the collection was opened with and the indexes Anki expects, and close the connection.
+        """
+        self._restore_pragmas()
+        if self.fts is not None:
+            self.fts.save_stamp()
+        self.db.database.close()
+
+    def set_profile(self, name):
+        """
+        :param name: 'default' (the pragmas the collection was opened with),
+        -- 'bulk' (fast writes that survive a crashed process but not a power loss,
+        -- some indexes dropped until the profile is left),
+        -- 'scratch' (as 'bulk', with the journal in memory; for throwaway collections only)
+        -- or 'read' (read-only, memory-mapped, exclusively locked)
+        """
+        self.pragmas.apply(name)
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Use the pragma profile `name` inside a `with` block, then switch back to the previous one.
+        """
+        previous = self.pragmas.current
+        self.pragmas.apply(name)
+        try:
+            yield self
+        finally:
+            self.pragmas.apply(previous)
 
     def __iter__(self):
         yield from self.iter_notes()
 
-    def iter_notes(self):
-        for db_note in anki_db.Notes.select():
-            record = db_note.flds
-            record = [db_note.id, db_note.mid] + record + [db_note.tags]
-
-            header = self.model_field_names_by_id(db_note.mid)
-            header = ['_nid', '_mid'] + header + ['_tags']
+    def iter_notes(self, model_id=None, deck_id=None, tag=None,
+                   batch_size=DEFAULT_BATCH_SIZE, as_record=False):
+        """
+        Stream notes in batches of `batch_size` rows, resolving field names once per model.
 
-            yield dict(zip(header, record))
+        :param model_id: only notes of this model
+        :param deck_id: only notes with at least one card in this deck
+        :param tag: only notes with this tag
+        :param batch_size:
+        :param as_record: yield :class:`NoteRecord` instead of dicts
+        :return:
+        """
+        query = self.db.Notes.select(self.db.Notes.id, self.db.Notes.mid, self.db.Notes.flds, self.db.Notes.tags)
+        if model_id is not None:
+            query = query.where(self.db.Notes.mid == model_id)
+        if deck_id is not None:
+            query = query.where(self.db.Notes.id.in_(
+                self.db.Cards.select(self.db.Cards.nid).where(self.db.Cards.did == deck_id)
+            ))
+        if tag is not None:
+            query = query.where(anki_db.tags_like(self.db.Notes, tag))
+
+        field_names = self.col_cache.get().field_names
+
+        for nid, mid, flds, tags in iter_keyset(query, self.db.Notes.id, batch_size):
+            record = NoteRecord(nid, mid, flds, tags, field_names[mid])
+            if as_record:
+                yield record
+            else:
+                yield record.to_dict()
 
-    @classmethod
-    def iter_cards(cls):
-        for db_card in anki_db.Cards.select():
-            db_note = anki_db.Notes.get(id=db_card.nid)
-            record = db_note.flds
-            record += db_note.tags
+    def iter_cards(self, deck_id=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Stream cards joined to their notes, in batches of `batch_size` rows.
 
-            db_col = anki_db.Col.get()
+        Deck, model and template names come from the cached Col metadata, so no per-card lookup is made.
+        """
+        query = self.db.Cards\
+            .select(self.db.Cards.id, self.db.Cards.did, self.db.Cards.ord,
+                    self.db.Notes.mid, self.db.Notes.flds, self.db.Notes.tags)\
+            .join(self.db.Notes, on=(self.db.Cards.nid == self.db.Notes.id))
+        if deck_id is not None:
+            query = query.where(self.db.Cards.did == deck_id)
 
-            db_deck = db_col.decks[str(db_card.did)]
-            record += db_deck['name']
+        col = self.col_cache.get()
 
-            db_model = db_col.models[str(db_note.mid)]
-            model_name = db_model['name']
-            template_names = [f['name'] for f in db_model['tmpls']]
+        for _, did, ord_, mid, flds, tags in iter_keyset(query, self.db.Cards.id, batch_size):
+            template_names = col.template_names[mid]
             try:
-                template = template_names[db_card.ord]
+                template = template_names[ord_]
             except IndexError:
                 template = template_names[0]
 
-            record += [model_name, template, db_card.ord]
-
-            header = [f['name'] for f in db_model['flds']]
-            header += ['tags', 'deck', 'model', 'template', 'order']
+            d = dict(zip(col.field_names[mid], flds))
+            d.update(
+                tags=tags,
+                deck=col.deck_names.get(did),
+                model=col.models[str(mid)]['name'],
+                template=template,
+                order=ord_
+            )
 
-            yield dict(zip(header, record))
+            yield d
 
-    @classmethod
-    def iter_excel(cls):
-        for d in cls.iter_cards():
+    def iter_excel(self, deck_id=None, batch_size=DEFAULT_BATCH_SIZE):
+        for d in self.iter_cards(deck_id=deck_id, batch_size=batch_size):
             d['tags'] = ' '.join(d['tags'])
             yield d
 
@@ -93,13 +182,16 @@ class Anki:
         else:
             pass
 
-    @classmethod
-    def init(cls,
+    def _save_col(self, db_col):
+        db_col.save()
+        self.col_cache.invalidate()
+
+    def init(self,
              first_model: Union[ModelBuilder, dict],
-             first_deck: Union[DeckBuilder, str]='Default',
-             first_dconf: Union[DConfBuilder, dict]=None,
-             first_note_data: Union[bool, dict]=True):
-        anki_db.database.create_tables([anki_db.Col, anki_db.Notes, anki_db.Cards, anki_db.Revlog, anki_db.Graves])
+              first_deck: Union[DeckBuilder, str]='Default',
+              first_dconf: Union[DConfBuilder, dict]=None,
+              first_note_data: Union[bool, dict]=True):
+        self.db.database.create_tables(self.db.models)
 
         if not isinstance(first_model, ModelBuilder):
             first_model = ModelBuilder(
@@ -130,101 +222,149 @@ class Anki:
         db_decks = dict()
         db_decks[str(first_deck.id)] = first_deck
 
-        if not anki_db.Col.get_or_none():
-            anki_db.Col.create(
+        if not self.db.Col.get_or_none():
+            self.db.Col.create(
                 models=db_models,
                 decks=db_decks,
                 dconf=db_dconf
             )
+            self.col_cache.invalidate()
 
         if first_note_data:
-            if not anki_db.Notes.get_or_none():
+            if not self.db.Notes.get_or_none():
                 if first_note_data is True:
                     first_note_data = dict()
                 first_note = NoteBuilder(model_id=first_model.id,
                                          model_field_names=first_model.field_names,
                                          data=first_note_data)
-                db_notes = anki_db.Notes.create(**first_note)
+                db_notes = self.db.Notes.create(**first_note)
                 first_note.id = db_notes.id
 
                 for template_name in first_model.template_names:
                     first_card = CardBuilder(first_note, first_deck.id, model=first_model, template=template_name)
-                    anki_db.Cards.create(**first_card)
+                    self.db.Cards.create(**first_card)
 
-    @classmethod
-    def add_model(cls, name, fields, templates, **kwargs):
-        db_col = anki_db.Col.get()
+    def add_model(self, name, fields, templates, **kwargs):
+        db_col = self.db.Col.get()
         db_models = db_col.models
         new_model = ModelBuilder(name, fields, templates, **kwargs)
         db_models[str(new_model.id)] = new_model
         db_col.models = db_models
-        db_col.save()
+        self._save_col(db_col)
 
         return new_model.id
 
-    @classmethod
-    def iter_model(cls, model_id):
-        header = cls.model_field_names_by_id(model_id)
-        for db_note in anki_db.Notes.select().where(anki_db.Notes.mid == model_id):
+    def iter_model(self, model_id):
+        for record in self.iter_notes(model_id=model_id, as_record=True):
             yield dict(
-                id=db_note.id,
-                **dict(zip(header, db_note.flds))
+                id=record.nid,
+                **record.fields
             )
 
     def get_tinydb_table(self):
+        """
+        Snapshot of every note in an in-memory TinyDB table, taken on the first call.
+        """
         if len(self.tdb) == 0:
             for note_data in self:
                 self.tdb.insert(note_data)
 
         return self.tdb
 
-    @classmethod
-    def change_deck_by_id(cls, card_ids, deck_id)->None:
-        anki_db.Cards.update(did=deck_id).where(anki_db.Cards.id.in_(card_ids)).execute()
+    def change_deck_by_id(self, card_ids, deck_id)->None:
+        with self.db.database.atomic():
+            update_by_ids(self.db.Cards.update(did=deck_id), self.db.Cards.id, card_ids)
 
-    @classmethod
-    def delete_decks_by_id(cls, deck_ids, cards_too=False)->None:
-        db_col = anki_db.Col.get()
-        db_decks = db_col.decks
+    def delete_decks_by_id(self, deck_ids, cards_too=False, dry_run=False) -> dict:
+        """
+        Delete decks, in one transaction. Deletions are recorded in `graves`, so that they are synced.
+
+        :param deck_ids:
+        :param cards_too: also delete the cards of the decks, and the notes left without cards
+        :param dry_run: only count what would be deleted
+        :return: {'decks': ..., 'cards': ..., 'notes': ...} counts
+        """
+        deck_ids = [int(did) for did in dict.fromkeys(deck_ids)]
+        card_ids = []
+        note_ids = []
+
+        with self.db.database.atomic():
+            db_col = self.db.Col.get()
+            db_decks = db_col.decks
+            missing = [did for did in deck_ids if str(did) not in db_decks]
+            if missing:
+                raise KeyError('Unknown deck ids: {}'.format(missing))
 
-        for deck_id in deck_ids:
-            db_decks.pop(str(deck_id))
             if cards_too:
-                for db_card in anki_db.Cards.select().where(anki_db.Cards.did == int(deck_id)):
-                    db_card.delete_instance()
+                nids = set()
+                for cid, nid in select_by_ids(self.db.Cards.select(self.db.Cards.id, self.db.Cards.nid),
+                                              self.db.Cards.did, deck_ids):
+                    card_ids.append(cid)
+                    nids.add(nid)
+
+                # Notes that still have a card in a deck that is kept
+                deleted_decks = set(deck_ids)
+                kept = {nid for nid, did in select_by_ids(self.db.Cards.select(self.db.Cards.nid, self.db.Cards.did),
+                                                          self.db.Cards.nid, nids)
+                        if did not in deleted_decks}
+                note_ids = sorted(nids - kept)
+
+            result = {
+                'decks': len(deck_ids),
+                'cards': len(card_ids),
+                'notes': len(note_ids)
+            }
+            if dry_run:
+                return result
+
+            deleted_notes = list(select_by_ids(
+                self.db.Notes.select(self.db.Notes.id, self.db.Notes.mid, self.db.Notes.tags),
+                self.db.Notes.id, note_ids))
+
+            update_by_ids(self.db.Cards.delete(), self.db.Cards.id, card_ids)
+            update_by_ids(self.db.Notes.delete(), self.db.Notes.id, note_ids)
+
+            insert_chunked(self.db.Graves, (
+                [dict(oid=cid, type=0) for cid in card_ids] +
+                [dict(oid=nid, type=1) for nid in note_ids] +
+                [dict(oid=did, type=2) for did in deck_ids]
+            ))
+
+            for deck_id in deck_ids:
+                db_decks.pop(str(deck_id))
+            db_col.decks = db_decks
+            self._save_col(db_col)
 
-        db_col.decks = db_decks
-        db_col.save()
+        for nid, mid, _ in deleted_notes:
+            self.upsert_index.note_deleted(nid, mid)
+        self.tag_index.notes_changed((nid, tags, []) for nid, _, tags in deleted_notes)
+        if self.fts is not None:
+            self.fts.notes_deleted(note_ids)
 
-    @classmethod
-    def model_by_id(cls, model_id) -> dict:
-        return anki_db.Col.get().models[str(model_id)]
+        return result
 
-    @classmethod
-    def model_field_names_by_id(cls, model_id):
-        model = cls.model_by_id(model_id)
-        return [f['name'] for f in model['flds']]
+    def model_by_id(self, model_id) -> dict:
+        return self.col_cache.get().models[str(model_id)]
 
-    @classmethod
-    def model_template_names_by_id(cls, model_id):
-        model = cls.model_by_id(model_id)
-        return [t['name'] for t in model['tmpls']]
+    def model_field_names_by_id(self, model_id):
+        return list(self.col_cache.get().field_names[int(model_id)])
 
-    @classmethod
-    def note_to_cards(cls, note_id):
+    def model_template_names_by_id(self, model_id):
+        return list(self.col_cache.get().template_names[int(model_id)])
+
+    def note_to_cards(self, note_id):
         def _get_dict():
-            db_note = anki_db.Notes.get(id=note_id)
-            template_names = cls.model_template_names_by_id(db_note.mid)
+            db_note = self.db.Notes.get(id=note_id)
+            template_names = self.model_template_names_by_id(db_note.mid)
 
-            for c in anki_db.Cards\
-                    .select(anki_db.Cards.id, anki_db.Cards.ord, anki_db.Cards.nid)\
-                    .where(anki_db.Cards.nid == note_id):
+            for c in self.db.Cards\
+                    .select(self.db.Cards.id, self.db.Cards.ord, self.db.Cards.nid)\
+                    .where(self.db.Cards.nid == note_id):
                 yield template_names[c.ord], c.id
 
         return dict(_get_dict())
 
-    @classmethod
-    def card_set_next_review(cls, card_id, type_, queue, due):
+    def card_set_next_review(self, card_id, type_, queue, due):
         """
 
         :param card_id:
@@ -241,14 +381,37 @@ class Anki:
         --   learning: integer timestamp
         :return:
         """
-        db_card = anki_db.Cards.get(id=card_id)
-        db_card.type = type_
-        db_card.queue = queue
-        db_card.due = due
-        db_card.save()
+        self.cards_set_next_review([(card_id, type_, queue, due)])
+
+    def cards_set_next_review(self, schedule):
+        """
+        Reschedule many cards in one transaction.
+
+        :param schedule: rows of (card_id, type, queue, due) or (card_id, type, queue, due, ivl, factor),
+        -- as a list of tuples, or a 2-D NumPy integer array. Columns are as in :meth:`card_set_next_review`.
+        :return: number of cards updated
+        """
+        rows = validate_schedule(schedule)
+        if not rows:
+            return 0
+
+        mod = int(time())
+        if len(rows[0]) == 6:
+            sql = 'UPDATE cards SET type = ?, queue = ?, due = ?, ivl = ?, factor = ?, mod = ?, usn = -1 WHERE id = ?'
+        else:
+            sql = 'UPDATE cards SET type = ?, queue = ?, due = ?, mod = ?, usn = -1 WHERE id = ?'
+
+        with self.db.database.atomic():
+            changed = executemany(self.db.database, sql, (tuple(row[1:]) + (mod, row[0]) for row in rows))
+            if changed != len(rows):
+                existing = dict(select_by_ids(self.db.Cards.select(self.db.Cards.id, self.db.Cards.id),
+                                              self.db.Cards.id, (row[0] for row in rows)))
+                for row in rows:
+                    self._get_or_raise(existing, row[0], self.db.Cards)
+
+        return changed
 
-    @classmethod
-    def card_set_stat(cls, card_id, reps, lapses, **revlog):
+    def card_set_stat(self, card_id, reps, lapses, **revlog):
         """
 
         :param card_id:
@@ -277,50 +440,99 @@ class Anki:
            --  0=learn, 1=review, 2=relearn, 3=cram
         :return:
         """
-        with anki_db.database.atomic():
-            db_card = anki_db.Cards.get(id=card_id)
+        with self.db.database.atomic():
+            db_card = self.db.Cards.get(id=card_id)
             db_card.reps = reps
             db_card.lapses = lapses
             db_card.save()
 
-            anki_db.Revlog.create(
+            self.db.Revlog.create(
                 cid=db_card.id,
                 **revlog
             )
 
-    @classmethod
-    def get_deck_config_by_deck_name(cls, deck_name):
-        deck_id = cls.deck_names_and_ids()[deck_name]
-        conf_id = anki_db.Col.get().decks[str(deck_id)]['conf']
-        db_dconf = anki_db.Col.get().dconf
-
-        return db_dconf[str(conf_id)]
-
-    @classmethod
-    def deck_config_names_and_ids(cls):
-        def _gen_dict():
-            for dconf_id, d in anki_db.Col.get().dconf.items():
-                yield d['name'], int(dconf_id)
-
-        return dict(_gen_dict())
-
-    @classmethod
-    def note_info(cls, note_id):
-        db_note = anki_db.Notes.get(id=note_id)
-        header, row = cls._raw_note_info(db_note)
-
-        return {
-            'noteId': db_note.id,
-            'modelId': db_note.mid,
-            'tags': db_note.tags,
-            'fields': dict(zip(header, row))
-        }
+    def import_reviews(self, reviews, chunk_size=DEFAULT_BATCH_SIZE):
+        """
+        Bulk import of review history, in one transaction.
 
-    @classmethod
-    def _raw_note_info(cls, db_note):
-        db_model = cls.model_by_id(db_note.mid)
+        Each chunk of events is inserted into `revlog`, then `reps`, `lapses`, `ivl` and `factor` of the cards
+        it touches are recomputed from their whole history with one UPDATE.
 
-        return db_model['flds'], db_note.flds
+        :param reviews: iterable of dicts with the columns of `revlog`, as in :meth:`card_set_stat`, plus `cid`.
+        -- `id` is the epoch-milliseconds time of the review; it is moved forward to the next free millisecond
+        -- if already taken, and defaults to now.
+        :param chunk_size:
+        :return: number of reviews imported
+        """
+        revlog_ids = anki_db.table_ids(self.db.Revlog)
+        imported = 0
+        update_sql = '''
+            UPDATE cards SET
+                reps = (SELECT COUNT(*) FROM revlog WHERE cid = cards.id),
+                lapses = (SELECT COUNT(*) FROM revlog WHERE cid = cards.id AND type = 1 AND ease = 1),
+                ivl = (SELECT ivl FROM revlog WHERE cid = cards.id ORDER BY id DESC LIMIT 1),
+                factor = COALESCE(
+                    (SELECT factor FROM revlog WHERE cid = cards.id AND factor > 0 ORDER BY id DESC LIMIT 1),
+                    factor
+                ),
+                mod = ?,
+                usn = -1
+            WHERE id IN ({})
+        '''
+
+        def _exists(rid):
+            return self.db.Revlog.select().where(self.db.Revlog.id == rid).exists()
+
+        with self.db.database.atomic():
+            for chunk in pv.chunked(reviews, chunk_size):
+                # Ids of this chunk that are already in revlog, plus the ids assigned so far in this chunk
+                taken = {rid for rid, in select_by_ids(self.db.Revlog.select(self.db.Revlog.id), self.db.Revlog.id,
+                                                       (r['id'] for r in chunk if r.get('id') is not None))}
+                # Where probing resumes for a colliding id, so that many reviews at the same millisecond stay linear
+                next_probe = dict()
+
+                rows = []
+                for review in chunk:
+                    rid = review.get('id')
+                    if rid is None:
+                        rid = revlog_ids.next()
+                    elif rid in taken:
+                        start = rid
+                        rid = next_probe.get(start, rid + 1)
+                        while rid in taken or _exists(rid):
+                            rid += 1
+                        next_probe[start] = rid + 1
+                    revlog_ids.reserve(rid)
+                    taken.add(rid)
+                    rows.append(dict(review, id=rid))
+
+                insert_chunked(self.db.Revlog, rows)
+                imported += len(rows)
+
+                mod = int(time())
+                for cids in chunked_ids((r['cid'] for r in rows), SQLITE_MAX_VARIABLE_NUMBER - 1):
+                    changed = self.db.database.execute_sql(
+                        update_sql.format(', '.join('?' for _ in cids)), [mod] + cids).rowcount
+                    if changed != len(cids):
+                        existing = dict(select_by_ids(self.db.Cards.select(self.db.Cards.id, self.db.Cards.id),
+                                                      self.db.Cards.id, cids))
+                        for cid in cids:
+                            self._get_or_raise(existing, cid, self.db.Cards)
+
+        return imported
+
+    def get_deck_config_by_deck_name(self, deck_name):
+        col = self.col_cache.get()
+        deck_id = col.deck_ids[deck_name]
+        conf_id = col.decks[str(deck_id)]['conf']
+
+        return col.dconf[str(conf_id)]
+
+    def deck_config_names_and_ids(self):
+        return dict(self.col_cache.get().dconf_ids)
+
+    def note_info(self, note_id):
+        return self.notes_info([note_id])[0]
 
     def _extract_ac_note(self, ac_note):
         data = ac_note['fields']
@@ -334,156 +546,324 @@ class Anki:
 
         return data, model_id
 
-    def upsert_note(self, ac_note, defaults_key='defaults', _lock=True):
+    def upsert_note(self, ac_note, defaults_key='defaults', match_fields=None, _lock=True):
         """
 
         :param ac_note: ac_note['data'] uses the same format as
         http://docs.peewee-orm.com/en/latest/peewee/api.html?highlight=get_or_create#Model.get_or_create
         :param defaults_key:
+        :param match_fields: fields identifying an existing note of the same model.
+        -- Defaults to every field outside of `defaults_key`.
         :param _lock:
         :return:
         """
         def _update_fields():
             for note_id in matching_ids:
-                self.update_note_fields(note_id=note_id, fields=data)
+                self.update_note_fields(note_id=note_id, fields=dict(data))
 
-            self.add_tags(note_ids=matching_ids, tags=ac_note.get('tags', []))
+            tags = ac_note.get('tags', [])
+            if tags:
+                self.add_tags(note_ids=matching_ids, tags=tags)
 
         data, model_id = self._extract_ac_note(ac_note)
-        tdb_table = self.get_tinydb_table()
-        original_data = data.copy()
-        data.update(data.pop(defaults_key))
-
-        matching_t_doc_ids = tdb_table.update(data,
-                                              self._build_tdb_query(original_data,
-                                                                    model_id=model_id,
-                                                                    _skip=defaults_key))
-
-        if matching_t_doc_ids:
-            matching_ids = [self.tdb.get(doc_id=doc_id)['_nid'] for doc_id in matching_t_doc_ids]
+        data = dict(data)
+        defaults = data.pop(defaults_key, dict())
+        if match_fields is None:
+            match_fields = list(data.keys())
+        data.update(defaults)
+
+        matching_ids = []
+        field_names = self.col_cache.get().field_names[int(model_id)]
+        if all(k in field_names for k in match_fields):
+            matching_ids = self.upsert_index.get(model_id, match_fields).find(data)
+
+        if matching_ids:
             if _lock:
-                with anki_db.database.atomic():
+                with self.db.database.atomic():
                     _update_fields()
             else:
                 _update_fields()
 
+            self.upsert_index.updated += len(matching_ids)
             return matching_ids
         else:
+            self.upsert_index.inserted += 1
             return [self._add_note(data, model_id, ac_note)]
 
-    def upsert_notes(self, ac_notes, defaults_key='defaults'):
-        note_ids_2d = []
+    def upsert_notes(self, ac_notes, defaults_key='defaults', match_fields=None,
+                     chunk_size=DEFAULT_BATCH_SIZE, job=None, progress=None):
+        """
+        Upsert a stream of notes, committing every `chunk_size` input rows.
+        Inserted and updated row counts are kept in `self.upsert_index.stats()`.
 
-        with anki_db.database.atomic():
-            for ac_note in ac_notes:
-                note_ids_2d.append(self.upsert_note(ac_note, defaults_key=defaults_key, _lock=False))
+        :param ac_notes: any iterable, including a generator
+        :param defaults_key:
+        :param match_fields:
+        :param chunk_size:
+        :param job: name under which the input offset and a hash of the rows committed so far are checkpointed.
+        -- Rerunning the same job skips the rows already committed, provided the input starts with the same rows.
+        :param progress: callable, called after each chunk with a dict of
+        -- offset, rows, rows_per_sec, inserted and updated
+        :return: note ids of the rows upserted in this run
+        """
+        ac_notes = iter(ac_notes)
+        digest = new_digest()
+        offset = 0
+
+        if job is not None:
+            done, done_hash = self.checkpoints.get(job)
+            for ac_note in islice(ac_notes, done):
+                row_digest(digest, ac_note)
+                offset += 1
+            if done_hash is not None and digest.hexdigest() != done_hash:
+                raise ValueError('Input of job {!r} does not match its checkpoint at offset {}'.format(job, done))
+
+        start = time()
+        inserted, updated = self.upsert_index.inserted, self.upsert_index.updated
+        rows = 0
+        note_ids = []
+
+        while True:
+            chunk = list(islice(ac_notes, chunk_size))
+            if not chunk:
+                break
 
-        return sum(note_ids_2d, [])
+            try:
+                with self.db.database.atomic():
+                    for ac_note in chunk:
+                        note_ids.extend(self.upsert_note(ac_note, defaults_key=defaults_key,
+                                                         match_fields=match_fields, _lock=False))
+                        row_digest(digest, ac_note)
+
+                    if job is not None:
+                        self.checkpoints.save(job, offset + len(chunk), digest.hexdigest())
+            except Exception:
+                # In-memory indexes may hold rows that were just rolled back
+                self.upsert_index.clear()
+                self.tag_index.invalidate()
+                self.col_cache.invalidate()
+                raise
+
+            offset += len(chunk)
+            rows += len(chunk)
+
+            if progress is not None:
+                elapsed = time() - start
+                progress({
+                    'offset': offset,
+                    'rows': rows,
+                    'rows_per_sec': rows / elapsed if elapsed else None,
+                    'inserted': self.upsert_index.inserted - inserted,
+                    'updated': self.upsert_index.updated - updated
+                })
+
+        return note_ids
+
+    def clear_checkpoint(self, job):
+        """
+        Forget the progress of an :meth:`upsert_notes` job, so that it starts from the first row again.
+        """
+        self.checkpoints.delete(job)
 
     def search_notes(self, conditions):
-        return self.get_tinydb_table().search(self._build_tdb_query(conditions))
-
-    @staticmethod
-    def _build_tdb_query(data, model_id=None, _skip=None):
-        query = None
-        for k, v in data.items():
-            if k != _skip:
-                if query is None:
-                    query = (tdb.Query()[k] == v)
-                else:
-                    query &= (tdb.Query()[k] == v)
+        model_id = conditions.get('_mid', None)
 
-        if model_id:
-            query &= (tdb.Query()['_mid'] == model_id)
+        return [note_data for note_data in self.iter_notes(model_id=model_id)
+                if all(note_data.get(k, None) == v for k, v in conditions.items())]
 
-        return query
-
-    def _add_note(self, data, model_id, ac_note):
+    def _extract_deck_id(self, ac_note, deck_ids=None):
+        """
+        :param deck_ids: deck name to id mapping to look up and extend, instead of reading Col
+        """
         deck_id = ac_note.get('deckId', None)
         if deck_id is None:
             self._warning()
 
+            if deck_ids is None:
+                deck_ids = self.deck_names_and_ids()
+
             deck_name = ac_note['deckName']
-            deck_id = self.deck_names_and_ids().get(deck_name, None)
+            deck_id = deck_ids.get(deck_name, None)
 
             if deck_id is None:
                 deck_id = self.create_deck(deck_name, conf=ac_note.get('dconf', 1))
+                deck_ids[deck_name] = deck_id
 
-        tags = ac_note.get('tags', [])
-        model_field_names = self.model_field_names_by_id(model_id)
+        return deck_id
 
-        first_note = NoteBuilder(model_id=model_id,
-                                 model_field_names=model_field_names,
-                                 data=data,
-                                 tags=tags)
-        db_note = anki_db.Notes.create(**first_note)
-        first_note.id = db_note.id
-
-        for i, _ in enumerate(self.model_template_names_by_id(model_id)):
-            first_card = CardBuilder(first_note, deck_id, template=i)
-            anki_db.Cards.create(**first_card)
-
-        tdb_table = self.get_tinydb_table()
-        tdb_table.insert({
-            '_nid': db_note.id,
-            '_mid': model_id,
-            '_tags': tags,
-            **data
-        })
-
-        return db_note.id
+    def _add_note(self, data, model_id, ac_note):
+        return self._insert_notes([(data, model_id, ac_note)])[0]
 
-    @classmethod
-    def update_note(cls, note_id, data, tags):
-        cls.update_note_fields(note_id, data)
-        cls.add_tags([note_id], tags)
+    def _insert_notes(self, entries, guid_fields=None):
+        """
+        Build the note and card rows in Python, then write them with chunked `executemany`.
+        The `pre_save` signals are bypassed, so ids, guid, sfld, csum and due are computed here.
+
+        :param entries: iterable of (data, model_id, ac_note)
+        :param guid_fields: field names to derive a deterministic guid from, together with the model id.
+        -- A note whose guid (derived, or given as ac_note['guid']) already exists is not inserted again.
+        -- Raises ValueError if a name is not a field of the note's model.
+        :return: note ids, in the order of `entries`
+        """
+        note_rows = []
+        card_rows = []
+        added = []
+        result = []
+
+        with self.db.database.atomic():
+            note_ids = anki_db.table_ids(self.db.Notes)
+            card_ids = anki_db.table_ids(self.db.Cards)
+            note_mod = int(time() * 1000)
+            card_mod = int(time())
+            guids = anki_db.note_guids(self.db.Notes)
+            fixed_guids = dict()
+            col = self.col_cache.get()
+            deck_ids = dict(col.deck_ids)
+            guid_models = set()
+
+            for data, model_id, ac_note in entries:
+                guid = ac_note.get('guid', None)
+                if guid is None and guid_fields is not None:
+                    model_id = int(model_id)
+                    if model_id not in guid_models:
+                        unknown = [k for k in guid_fields if k not in col.field_index[model_id]]
+                        if unknown:
+                            raise ValueError('guid_fields {} are not fields of model {!r}'
+                                             .format(unknown, col.models[str(model_id)]['name']))
+                        guid_models.add(model_id)
+                    guid = guid_for(model_id, *(data.get(k, '') for k in guid_fields))
+
+                if guid is not None:
+                    existing_id = fixed_guids.get(guid, None)
+                    if existing_id is None and guid in guids:
+                        existing_id = self.db.Notes.select(self.db.Notes.id)\
+                            .where(self.db.Notes.guid == guid).scalar()
+                    if existing_id is not None:
+                        result.append(existing_id)
+                        continue
+                    guids.add(guid)
+                else:
+                    guid = guids.new()
+
+                deck_id = self._extract_deck_id(ac_note, deck_ids)
+
+                note = NoteBuilder(model_id=model_id,
+                                   model_field_names=col.field_names[int(model_id)],
+                                   data=data,
+                                   tags=ac_note.get('tags', []))
+                note.id = note_ids.next()
+                fixed_guids[guid] = note.id
+
+                sfld = stripHTMLMedia(note['flds'][0])
+                note_rows.append(dict(
+                    note,
+                    id=note.id,
+                    guid=guid,
+                    mod=note_mod,
+                    sfld=sfld,
+                    csum=field_checksum(sfld)
+                ))
+
+                for i, _ in enumerate(col.template_names[int(model_id)]):
+                    card_rows.append(dict(
+                        CardBuilder(note, deck_id, template=i),
+                        id=card_ids.next(),
+                        mod=card_mod,
+                        due=note.id
+                    ))
+
+                added.append((note.id, model_id, data))
+                result.append(note.id)
+
+            insert_chunked(self.db.Notes, note_rows)
+            insert_chunked(self.db.Cards, card_rows)
+
+        for note_id, model_id, data in added:
+            self.upsert_index.note_added(note_id, model_id, data)
+
+        self.tag_index.notes_changed((row['id'], [], row['tags']) for row in note_rows)
+        if self.fts is not None:
+            self.fts.notes_changed((row['id'], row['flds']) for row in note_rows)
+
+        return result
+
+    def update_note(self, note_id, data, tags):
+        self.update_note_fields(note_id, data)
+        self.add_tags([note_id], tags)
 
     ################################
     # Original AnkiConnect Methods #
     ################################
 
-    @classmethod
-    def deck_names(cls):
-        return [d['name'] for d in anki_db.Col.get().decks.values()]
+    def deck_names(self):
+        return list(self.col_cache.get().deck_ids.keys())
+
+    def deck_names_and_ids(self):
+        return dict(self.col_cache.get().deck_ids)
+
+    def get_decks(self, card_ids):
+        """
+        :return: {deck name: card ids}, each list in the order of `card_ids`, without duplicates;
+        -- unknown card ids are left out
+        """
+        card_ids = list(dict.fromkeys(card_ids))
+        deck_names = self.col_cache.get().deck_names
+        card_decks = dict(select_by_ids(self.db.Cards.select(self.db.Cards.id, self.db.Cards.did),
+                                        self.db.Cards.id, card_ids))
+
+        decks = dict()
+        for card_id in card_ids:
+            did = card_decks.get(card_id)
+            if did is not None:
+                decks.setdefault(deck_names.get(did, did), []).append(card_id)
+
+        return decks
 
-    @classmethod
-    def deck_names_and_ids(cls):
-        def _gen_dict():
-            for did, d in anki_db.Col.get().decks.items():
-                yield d['name'], int(did)
+    def deck_card_counts(self, deck_ids=None):
+        """
+        Count cards per deck and queue in one pass over the `ix_cards_sched` index.
+
+        :param deck_ids: defaults to every deck in the collection
+        :return: {deck_id: {'new', 'learning', 'review', 'suspended', 'buried'}}
+        -- Cards in the v2 scheduler's preview queue (4) count as learning; other unknown queues are skipped.
+        """
+        queue_names = {0: 'new', 1: 'learning', 3: 'learning', 4: 'learning', 2: 'review',
+                       -1: 'suspended', -2: 'buried', -3: 'buried'}
 
-        return dict(_gen_dict())
+        if deck_ids is None:
+            deck_ids = list(self.col_cache.get().deck_names.keys())
 
-    @classmethod
-    def get_decks(cls, card_ids):
-        def _gen_dict():
-            for did, d in anki_db.Col.get().decks.items():
-                db_cards = anki_db.Cards.select(anki_db.Cards.id, anki_db.Cards.did)\
-                    .where((anki_db.Cards.did == int(did)) & (anki_db.Cards.id.in_(card_ids)))
-                if len(db_cards) > 0:
-                    yield d['name'], [c.id for c in db_cards]
+        counts = {int(did): dict.fromkeys(['new', 'learning', 'review', 'suspended', 'buried'], 0)
+                  for did in deck_ids}
 
-        return dict(_gen_dict())
+        query = self.db.Cards.select(self.db.Cards.did, self.db.Cards.queue, pv.fn.COUNT(self.db.Cards.id))\
+            .group_by(self.db.Cards.did, self.db.Cards.queue)
+        for did, queue, count in select_by_ids(query, self.db.Cards.did, counts.keys()):
+            name = queue_names.get(queue)
+            if name is not None:
+                counts[did][name] += count
 
-    @classmethod
-    def create_deck(cls, deck_name, desc='', dconf=1, **kwargs):
-        db_col = anki_db.Col.get()
+        return counts
+
+    def create_deck(self, deck_name, desc='', dconf=1, **kwargs):
+        db_col = self.db.Col.get()
         db_decks = db_col.decks
-        existing_decks = cls.deck_names()
+        existing_decks = self.deck_names()
 
         deck_name_parts = deck_name.split('::')
         sub_deck_parts = []
-        for i, part in enumerate(deck_name_parts):
+        for part in deck_name_parts:
             sub_deck_parts.append(part)
             sub_deck = '::'.join(sub_deck_parts)
             if sub_deck not in existing_decks:
-                new_deck = DeckBuilder(name=sub_deck, desc=desc, dconf=dconf, id_=int(time() * 1000) + i, **kwargs)
+                new_deck = DeckBuilder(name=sub_deck, desc=desc, dconf=dconf,
+                                       id_=anki_db.deck_ids(self.db.Col).next(), **kwargs)
                 db_decks[str(new_deck.id)] = new_deck
 
         db_col.decks = db_decks
-        db_col.save()
+        self._save_col(db_col)
 
-        return cls.deck_names_and_ids()[deck_name]
+        return self.deck_names_and_ids()[deck_name]
 
     def change_deck(self, card_ids, deck_name, dconf=1):
         self._warning()
@@ -494,232 +874,366 @@ class Anki:
 
         self.change_deck_by_id(card_ids, deck_id)
 
-    def delete_decks(self, deck_names, cards_too=False):
+    def delete_decks(self, deck_names, cards_too=False, dry_run=False):
         self._warning()
 
         deck_mapping = self.deck_names_and_ids()
         deck_ids = [deck_mapping[deck_name] for deck_name in deck_names]
 
-        self.delete_decks_by_id(deck_ids, cards_too)
+        return self.delete_decks_by_id(deck_ids, cards_too, dry_run)
 
     def get_deck_config(self, deck_name):
         self._warning()
 
         return self.get_deck_config_by_deck_name(deck_name)
 
-    @classmethod
-    def save_deck_config(cls, config: dict):
-        db_col = anki_db.Col.get()
+    def save_deck_config(self, config: dict):
+        db_col = self.db.Col.get()
         db_dconf = db_col.dconf
 
         dconf = DConfBuilder(config.pop('name'), **config)
         db_dconf[str(dconf.id)] = dconf
 
         db_col.dconf = db_dconf
-        db_col.save()
+        self._save_col(db_col)
 
         return dconf.id
 
-    @classmethod
-    def set_deck_config_id(cls, deck_names, config_id):
+    def set_deck_config_id(self, deck_names, config_id):
         is_edited = False
-        db_col = anki_db.Col.get()
+        db_col = self.db.Col.get()
         db_decks = db_col.decks
 
-        for k, v in cls.deck_names_and_ids().items():
+        for k, v in self.deck_names_and_ids().items():
             if k in deck_names:
                 db_decks[str(v)]['conf'] = config_id
                 is_edited = True
 
         if is_edited:
             db_col.decks = db_decks
-            db_col.save()
+            self._save_col(db_col)
 
         return is_edited
 
-    @classmethod
-    def clone_deck_config_id(cls, dconf_name, clone_from: int):
-        db_col = anki_db.Col.get()
+    def clone_deck_config_id(self, dconf_name, clone_from: int):
+        db_col = self.db.Col.get()
         db_dconf = db_col.dconf
         new_dconf = DConfBuilder(dconf_name)
         new_dconf.update(db_dconf[str(clone_from)])
         db_dconf[new_dconf.id] = new_dconf
         db_col.dconf = db_dconf
-        db_col.save()
+        self._save_col(db_col)
 
         return new_dconf.id
 
-    @classmethod
-    def remove_deck_config_id(cls, config_id):
-        db_col = anki_db.Col.get()
+    def remove_deck_config_id(self, config_id):
+        db_col = self.db.Col.get()
         db_dconf = db_col.dconf
         db_dconf.pop(config_id)
         db_col.dconf = db_dconf
-        db_col.save()
+        self._save_col(db_col)
 
         return True
 
-    @classmethod
-    def model_names(cls):
-        return [m['name'] for m in anki_db.Col.get().models.values()]
+    def model_names(self):
+        return list(self.col_cache.get().model_ids.keys())
 
-    @classmethod
-    def model_names_and_ids(cls):
-        def _gen_dict():
-            for mid, m in anki_db.Col.get().models.items():
-                yield m['name'], int(mid)
+    def model_names_and_ids(self):
+        return dict(self.col_cache.get().model_ids)
 
-        return dict(_gen_dict())
+    def model_field_names(self, model_name):
+        model_id = self.model_names_and_ids()[model_name]
+        return self.model_field_names_by_id(model_id)
 
-    @classmethod
-    def model_field_names(cls, model_name):
-        model_id = cls.model_names_and_ids()[model_name]
-        return cls.model_field_names_by_id(model_id)
+    def model_template_names(self, model_name):
+        model_id = self.model_names_and_ids()[model_name]
+        return self.model_template_names_by_id(model_id)
 
-    @classmethod
-    def model_template_names(cls, model_name):
-        model_id = cls.model_names_and_ids()[model_name]
-        return cls.model_template_names_by_id(model_id)
+    def model_fields_on_templates(self, model_name):
+        """
+        :return: {template name: [[fields on the question], [fields on the answer]]}
+        """
+        model_id = self.model_names_and_ids()[model_name]
+        model = self.model_by_id(model_id)
+        field_names = self.col_cache.get().field_names[model_id]
 
-    # @classmethod
-    # def model_fields_on_templates(cls, model_name):
-    #     raise NotImplementedError
+        def _fields_on(template):
+            names = []
+            for ref in re.findall(r'{{([^}]+)}}', template):
+                name = ref.lstrip('#^/').split(':')[-1].strip()
+                if name in field_names and name not in names:
+                    names.append(name)
+
+            return names
+
+        return {t['name']: [_fields_on(t['qfmt']), _fields_on(t['afmt'])] for t in model['tmpls']}
 
     def add_note(self, ac_note):
         data, model_id = self._extract_ac_note(ac_note)
 
         return self._add_note(data, model_id, ac_note)
 
-    def add_notes(self, ac_notes):
-        return [self.add_note(ac_note) for ac_note in ac_notes]
+    def add_notes(self, ac_notes, guid_fields=None):
+        """
+        Add all `ac_notes` in one transaction, with batched inserts.
+
+        :param ac_notes:
+        :param guid_fields: field names of the model to derive each note's guid from, with the model id,
+        so that re-importing the same source returns the existing note ids instead of adding duplicates
+        :return: note ids, in input order
+        """
+        def _gen_entries():
+            for ac_note in ac_notes:
+                data, model_id = self._extract_ac_note(ac_note)
+                yield data, model_id, ac_note
+
+        return self._insert_notes(_gen_entries(), guid_fields=guid_fields)
 
     # @classmethod
     # def can_add_notes(cls, ac_notes):
     #     raise NotImplementedError
 
-    @classmethod
-    def update_note_fields(cls, note_id, fields: dict):
-        db_note = anki_db.Notes.get(id=note_id)
+    def update_note_fields(self, note_id, fields: dict):
+        self.update_notes_fields({note_id: fields})
 
-        field_names = cls.model_field_names_by_id(db_note.mid)
-        prev_note_fields = db_note.flds
-        note_fields = []
+    def update_notes_fields(self, notes: dict):
+        """
+        Update many notes in one transaction, recomputing sfld and csum.
+        Field names that a note's model does not have yet are added to the model, once per model.
 
-        for i, name in enumerate(field_names):
-            note_field = fields.pop(name, None)
-            if note_field is not None:
-                note_fields.append(note_field)
-            else:
-                note_fields.append(prev_note_fields[i])
-        
-        if fields:
-            model = cls.model_by_id(db_note.mid)
-
-            for k, v in fields.items():
-                model['flds'].append(
-                    FieldBuilder(name=k, order=len(model['flds']))
-                )
-                note_fields.append(v)
-            
-            col = anki_db.Col.get()
-            m = col.models
-            m[str(model['id'])] = model
-            col.models = m
-            col.save()
-
-        anki_db.Notes.update(
-            flds=note_fields
-        ).where(anki_db.Notes.id == note_id).execute()
-
-    @classmethod
-    def add_tags(cls, note_ids, tags: Union[str, list]):
-        if isinstance(tags, str):
-            tags = [tags]
-        else:
-            tags = list(tags)
+        :param notes: {note id: {field name: value}}; None values leave the field unchanged
+        :return: number of notes updated
+        """
+        notes = {int(nid): fields for nid, fields in notes.items()}
+        mod = int(time() * 1000)
+        updated = []
+
+        with self.db.database.atomic():
+            db_notes = {nid: (mid, flds) for nid, mid, flds in select_by_ids(
+                self.db.Notes.select(self.db.Notes.id, self.db.Notes.mid, self.db.Notes.flds),
+                self.db.Notes.id, notes.keys())}
+            for nid in notes.keys():
+                self._get_or_raise(db_notes, nid, self.db.Notes)
+
+            field_index = self.col_cache.get().field_index
+            new_fields = dict()
+            for nid, fields in notes.items():
+                mid = db_notes[nid][0]
+                for name in fields.keys():
+                    if name not in field_index[mid]:
+                        new_fields.setdefault(mid, dict())[name] = None
+
+            if new_fields:
+                db_col = self.db.Col.get()
+                m = db_col.models
+                for mid, names in new_fields.items():
+                    model = m[str(mid)]
+                    for name in names.keys():
+                        model['flds'].append(
+                            FieldBuilder(name=name, order=len(model['flds']))
+                        )
+
+                db_col.models = m
+                self._save_col(db_col)
+                field_index = self.col_cache.get().field_index
+
+            rows = []
+            for nid, fields in notes.items():
+                mid, note_fields = db_notes[nid]
+                index = field_index[mid]
+                note_fields = note_fields + [''] * (len(index) - len(note_fields))
+                for name, value in fields.items():
+                    if value is not None:
+                        note_fields[index[name]] = str(value)
+
+                sfld = stripHTMLMedia(note_fields[0])
+                rows.append((self.db.Notes.flds.db_value(note_fields), sfld, field_checksum(sfld), mod, nid))
+                updated.append((nid, mid, note_fields))
+
+            executemany(self.db.database,
+                        'UPDATE notes SET flds = ?, sfld = ?, csum = ?, mod = ?, usn = -1 WHERE id = ?', rows)
+
+        field_names = self.col_cache.get().field_names
+        for nid, mid, note_fields in updated:
+            self.upsert_index.note_updated(nid, mid, dict(zip(field_names[mid], note_fields)))
+        if self.fts is not None:
+            self.fts.notes_changed((nid, note_fields) for nid, _, note_fields in updated)
+
+        return len(updated)
+
+    def add_tags(self, note_ids, tags: Union[str, list]):
+        """
+        :param note_ids:
+        :param tags: list of tags, or a space-separated string
+        :return: number of notes whose tags changed
+        """
+        tags = self._split_tags(tags)
+
+        def _add(note_tags):
+            existing = {t.lower() for t in note_tags}
+            return sorted(note_tags + [t for t in tags if t.lower() not in existing], key=str.lower)
 
-        anki_db.Notes.update(
-            tags=sorted(set(list(anki_db.Notes.tags)) | set(tags))
-        ).where(anki_db.Notes.id.in_(note_ids)).execute()
+        return self._change_tags(note_ids, _add)
 
-    @classmethod
-    def remove_tags(cls, note_ids, tags: Union[str, list]):
+    def remove_tags(self, note_ids, tags: Union[str, list]):
+        """
+        :param note_ids:
+        :param tags: list of tags, or a space-separated string
+        :return: number of notes whose tags changed
+        """
+        removed = {t.lower() for t in self._split_tags(tags)}
+
+        def _remove(note_tags):
+            return [t for t in note_tags if t.lower() not in removed]
+
+        return self._change_tags(note_ids, _remove)
+
+    @staticmethod
+    def _split_tags(tags):
         if isinstance(tags, str):
-            tags = [tags]
+            tags = tags.split()
 
-        anki_db.Notes.update(
-            tags=sorted(set(anki_db.Notes.tags) - set(tags))
-        ).where(anki_db.Notes.id.in_(note_ids))
+        return list(dict.fromkeys(t for t in tags if t))
 
-    @classmethod
-    def get_tags(cls):
-        all_tags = set()
-        for db_note in anki_db.Notes.select(anki_db.Notes.tags):
-            all_tags.update(db_note.tags)
+    def _change_tags(self, note_ids, fn):
+        """
+        Read the tags of `note_ids` chunk by chunk, and write back with `executemany` only the rows where
+        `fn(tags)` differs.
+        """
+        changes = []
+        mod = int(time() * 1000)
 
-        return sorted(all_tags)
+        with self.db.database.atomic():
+            for chunk in chunked_ids(note_ids):
+                rows = []
+                for nid, note_tags in self.db.Notes.select(self.db.Notes.id, self.db.Notes.tags)\
+                        .where(self.db.Notes.id.in_(chunk)).tuples():
+                    new_tags = fn(note_tags)
+                    if new_tags != note_tags:
+                        rows.append((self.db.Notes.tags.db_value(new_tags), mod, nid))
+                        changes.append((nid, note_tags, new_tags))
 
-    # @classmethod
-    # def find_notes(cls, query: str):
-    #     raise NotImplementedError
+                executemany(self.db.database, 'UPDATE notes SET tags = ?, mod = ?, usn = -1 WHERE id = ?', rows)
 
-    @classmethod
-    def notes_info(cls, note_ids):
-        return [cls.note_info(note_id) for note_id in note_ids]
+        self.tag_index.notes_changed(changes)
 
-    @classmethod
-    def suspend(cls, card_ids):
-        if anki_db.Cards.update(queue=-1).where(anki_db.Cards.id.in_(card_ids)).execute() > 0:
-            return True
+        return len(changes)
 
-        return False
+    def get_tags(self):
+        return self.tag_index.tags()
+
+    def note_ids_by_tag(self, tag):
+        return self.tag_index.note_ids(tag)
+
+    def find_notes(self, query: str):
+        """
+        :param query: Anki search syntax, e.g. 'deck:Japanese tag:verb -is:suspended'
+        :return: sorted note ids
+        """
+        return [nid for nid, in self.search.notes_query(query).order_by(self.db.Notes.id).tuples()]
+
+    def enable_fts(self, path=None):
+        """
+        Keep a full-text index of the notes in a side database, built on first use, and rebuilt if the notes
+        were edited since the last session that had it enabled was closed.
+
+        :param path: defaults to the collection path, plus '.fts'
+        :return: the FullTextIndex
+        """
+        if self.fts is None:
+            self.fts = FullTextIndex(self.db, path if path is not None else '{}.fts'.format(self.anki2_path))
+            if self.fts.attach():
+                self.fts.rebuild()
+
+        return self.fts
+
+    def search_text(self, query: str, limit=None):
+        """
+        :param query: words that must all appear in the note, HTML and media references excluded
+        :param limit:
+        :return: note ids, best match first
+        """
+        if self.fts is None:
+            raise ValueError('Full-text index is not enabled; call enable_fts() first')
+
+        return self.fts.search(query, limit=limit)
+
+    def notes_info(self, note_ids):
+        note_ids = list(note_ids)
+        field_names = self.col_cache.get().field_names
 
-    @classmethod
-    def unsuspend(cls, card_ids):
-        if anki_db.Cards.update(queue=anki_db.Cards.type).where(anki_db.Cards.id.in_(card_ids)).execute() > 0:
-            return True
+        all_info = dict()
+        for nid, mid, flds, tags in select_by_ids(
+                self.db.Notes.select(self.db.Notes.id, self.db.Notes.mid, self.db.Notes.flds, self.db.Notes.tags),
+                self.db.Notes.id, note_ids):
+            all_info[nid] = {
+                'noteId': nid,
+                'modelId': mid,
+                'tags': tags,
+                'fields': dict(zip(field_names[mid], flds))
+            }
+
+        return [self._get_or_raise(all_info, note_id, self.db.Notes) for note_id in note_ids]
+
+    @staticmethod
+    def _get_or_raise(d, key, model):
+        try:
+            return d[key]
+        except KeyError:
+            raise model.DoesNotExist('{} {} does not exist'.format(model.__name__, key))
+
+    def _cards_column(self, card_ids, column):
+        """
+        Values of `column` for `card_ids`, in the same order, raising `Cards.DoesNotExist` if any id is missing.
+        """
+        card_ids = list(card_ids)
+        values = dict(select_by_ids(self.db.Cards.select(self.db.Cards.id, column), self.db.Cards.id, card_ids))
+
+        return [self._get_or_raise(values, card_id, self.db.Cards) for card_id in card_ids]
+
+    def suspend(self, card_ids):
+        with self.db.database.atomic():
+            if update_by_ids(self.db.Cards.update(queue=-1), self.db.Cards.id, card_ids) > 0:
+                return True
 
         return False
 
-    @classmethod
-    def are_suspended(cls, card_ids):
-        def _gen_list():
-            for card_id in card_ids:
-                db_card = anki_db.Cards.get(id=card_id)
-                yield (db_card.queue == -1)
+    def unsuspend(self, card_ids):
+        with self.db.database.atomic():
+            if update_by_ids(self.db.Cards.update(queue=self.db.Cards.type), self.db.Cards.id, card_ids) > 0:
+                return True
 
-        return list(_gen_list())
+        return False
 
-    @classmethod
-    def are_due(cls, card_ids):
-        def _gen_list():
-            for card_id in card_ids:
-                db_card = anki_db.Cards.get(id=card_id)
-                yield (db_card.type == 2)
+    def are_suspended(self, card_ids):
+        return [queue == -1 for queue in self._cards_column(card_ids, self.db.Cards.queue)]
 
-        return list(_gen_list())
+    def are_due(self, card_ids):
+        return [type_ == 2 for type_ in self._cards_column(card_ids, self.db.Cards.type)]
 
     # @classmethod
     # def get_intervals(cls, card_ids, complete=False):
     #     raise NotImplementedError
-    #
-    # @classmethod
-    # def find_cards(cls, query):
-    #     raise NotImplementedError
 
-    @classmethod
-    def cards_to_notes(cls, card_ids):
+    def find_cards(self, query: str):
+        """
+        :param query: Anki search syntax, e.g. 'deck:Japanese is:due prop:ivl>10'
+        :return: sorted card ids
+        """
+        return [cid for cid, in self.search.cards_query(query).order_by(self.db.Cards.id).tuples()]
+
+    def explain(self, query: str, cards=False):
+        """
+        :return: SQLite's query plan for :meth:`find_notes`, or :meth:`find_cards` if `cards` is True
+        """
+        return self.search.explain(query, cards=cards)
+
+    def cards_to_notes(self, card_ids):
         note_ids = set()
-        for db_card in anki_db.Cards.select(anki_db.Cards.id, anki_db.Cards.nid).where(anki_db.Cards.id.in_(card_ids)):
-            note_ids.update(db_card.nid)
+        for nid, in select_by_ids(self.db.Cards.select(self.db.Cards.nid), self.db.Cards.id, card_ids):
+            note_ids.add(nid)
 
         return sorted(note_ids)
 
-    @classmethod
-    def cards_info(cls, card_ids):
-        all_info = list()
-        for card_id in card_ids:
-            db_card = anki_db.Cards.get(id=card_id)
-            all_info += cls.notes_info([db_card.nid])
-
-        return all_info
+    def cards_info(self, card_ids):
+        return self.notes_info(self._cards_column(card_ids, self.db.Cards.nid))
@@ -6,6 +6,9 @@ from time import time
 from ankisync.builder.guid import guid64
 from ankisync.builder.default import create_conf, create_tags
 from ankisync.anki_util import field_checksum, stripHTMLMedia
+from ankisync.ids import IdAllocator
+from ankisync.guids import GuidService
+from ankisync.batch import iter_keyset
 
 database = pv.SqliteDatabase(None)
 
@@ -17,10 +20,13 @@ class BaseModel(signals.Model):
 
 class TagField(pv.TextField):
     def db_value(self, value):
-        return ' '.join(value)
+        if value:
+            return ' {} '.format(' '.join(value))
+
+        return ''
 
     def python_value(self, value):
-        return value.strip().split(' ')
+        return value.split()
 
 
 class JSONField(pv.TextField):
@@ -49,6 +55,17 @@ class ListField(pv.TextField):
         return value.split('\u001f')
 
 
+def field_at(flds, index):
+    """
+    SQL function `ankisync_field`, returning field number `index` of a raw `notes.flds` value, or '' if there is none.
+    """
+    fields = flds.split('\u001f')
+    if 0 <= index < len(fields):
+        return fields[index]
+
+    return ''
+
+
 class Col(BaseModel):
     """
     -- col contains a single row that holds various information about the collection
@@ -157,17 +174,28 @@ class Notes(BaseModel):
 
 @signals.pre_save(sender=Notes)
 def notes_pre_save(model_class, instance, created):
-    while model_class.get_or_none(id=instance.id) is not None:
-        instance.id = model_class.select(pv.fn.Max(model_class.id)).scalar() + 1
-
-    while model_class.get_or_none(guid=instance.guid) is not None:
-        instance.guid = guid64()
+    if created:
+        instance.id = table_ids(model_class).claim(instance.id)
+        instance.guid = note_guids(model_class).claim(instance.guid)
 
     instance.mod = int(time() * 1000)
     instance.sfld = stripHTMLMedia(instance.flds[0])
     instance.csum = field_checksum(instance.sfld)
 
 
+def tags_like(notes, pattern):
+    """
+    `LIKE "% tag %"` condition on Notes.tags, whether or not the stored string is space-padded.
+
+    :param notes: the Notes model of the collection
+    :param pattern: a tag, optionally with LIKE wildcards
+    """
+    return pv.NodeList((
+        pv.SQL("(' ' ||"), notes.tags, pv.SQL("|| ' ') LIKE"),
+        pv.Value('% {} %'.format(pattern), converter=False)
+    ))
+
+
 class Cards(BaseModel):
     """
     -- Cards are what you review.
@@ -252,8 +280,8 @@ class Cards(BaseModel):
 
 @signals.pre_save(sender=Cards)
 def cards_pre_save(model_class, instance, created):
-    while model_class.get_or_none(id=instance.id) is not None:
-        instance.id = model_class.select(pv.fn.Max(model_class.id)).scalar() + 1
+    if created:
+        instance.id = table_ids(model_class).claim(instance.id)
 
     instance.mod = int(time())
     if instance.due is None:
@@ -307,8 +335,8 @@ class Revlog(BaseModel):
 
 @signals.pre_save(sender=Revlog)
 def revlog_pre_save(model_class, instance, created):
-    while model_class.get_or_none(id=instance.id) is not None:
-        instance.id = model_class.select(pv.fn.Max(model_class.id)).scalar() + 1
+    if created:
+        instance.id = table_ids(model_class).claim(instance.id)
 
 
 class Graves(BaseModel):
@@ -330,3 +358,106 @@ class Graves(BaseModel):
 
     class Meta:
         primary_key = False
+
+
+def table_ids(model_class):
+    """
+    Id allocator of `model_class`'s table, seeded from `MAX(id)`.
+    """
+    return model_class._model_set.id_allocator(model_class._meta.table_name,
+                                               lambda: model_class.select(pv.fn.Max(model_class.id)).scalar())
+
+
+def deck_ids(col):
+    """
+    Id allocator for new decks, seeded once from the largest deck id in `Col.decks`.
+
+    :param col: the Col model of the collection
+    """
+    def _read_max():
+        db_col = col.get_or_none()
+        if db_col is not None:
+            return max((int(did) for did in db_col.decks.keys()), default=0)
+
+    return col._model_set.id_allocator('decks', _read_max)
+
+
+def note_guids(notes):
+    """
+    Guid service of the notes table, loaded from the collection on first use.
+
+    :param notes: the Notes model of the collection
+    """
+    return notes._model_set.guid_service(
+        lambda: (guid for _, guid in iter_keyset(notes.select(notes.id, notes.guid), notes.id)),
+        lambda guid: notes.select().where(notes.guid == guid).exists()
+    )
+
+
+MODELS = (Col, Notes, Cards, Revlog, Graves)
+
+
+class ModelSet:
+    """
+    Subclasses of :data:`MODELS` bound to one collection's own database, so that several collections
+    can be open at once, from any thread. `DoesNotExist` is shared with the module-level models.
+
+    The id allocators and the guid service of the collection are kept here too. They are reloaded from the file
+    when SQLite's `data_version` shows that another connection has committed since they were last used.
+    """
+    def __init__(self, database):
+        self.database = database
+        database.register_function(field_at, 'ankisync_field', 2)
+
+        self._id_allocators = dict()
+        self._guid_service = None
+        self._data_version = None
+
+        for model in MODELS:
+            bound = type(model.__name__, (model,), {
+                '__module__': model.__module__,
+                '_model_set': self,
+                'Meta': type('Meta', (), {
+                    'database': database,
+                    'table_name': model._meta.table_name
+                })
+            })
+            bound.DoesNotExist = model.DoesNotExist
+            setattr(self, model.__name__, bound)
+
+    def data_version(self):
+        """
+        SQLite's `data_version` of the connection, which changes whenever another connection commits to the file.
+        """
+        return self.database.execute_sql('PRAGMA data_version').fetchone()[0]
+
+    def _check_data_version(self):
+        data_version = self.data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            for allocator in self._id_allocators.values():
+                allocator.reset()
+            if self._guid_service is not None:
+                self._guid_service.reset()
+
+    def id_allocator(self, name, read_max) -> IdAllocator:
+        """
+        Allocator of table `name`, created with `read_max` on first use.
+        """
+        self._check_data_version()
+        allocator = self._id_allocators.get(name)
+        if allocator is None:
+            allocator = self._id_allocators[name] = IdAllocator(read_max)
+
+        return allocator
+
+    def guid_service(self, read_existing, exists) -> GuidService:
+        self._check_data_version()
+        if self._guid_service is None:
+            self._guid_service = GuidService(read_existing, exists)
+
+        return self._guid_service
+
+    @property
+    def models(self):
+        return [getattr(self, model.__name__) for model in MODELS]
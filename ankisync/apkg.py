@@ -1,22 +1,109 @@
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, ZIP64_LIMIT
 from tempfile import mkdtemp
 import atexit
+import copy
+import os
 import shutil
+import struct
 from pathlib import Path
+from itertools import islice
 import json
+import time
 
 from .anki import Anki
+from .batch import DEFAULT_BATCH_SIZE
+from .media import MediaDedup, rewrite_media_references
+
+# Formats that are compressed already, so deflating them again only costs time
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.ogg', '.m4a', '.mp4', '.webm'}
+
+_LOCAL_HEADER_SIZE = 30
+_ZIP64_EXTRA_ID = 0x0001
+
+
+def _compress_type(filename):
+    if os.path.splitext(filename)[1].lower() in STORED_EXTENSIONS:
+        return ZIP_STORED
+
+    return ZIP_DEFLATED
+
+
+def _without_zip64_extra(extra):
+    """
+    `extra` without its Zip64 records, which `ZipInfo.FileHeader()` appends itself when the sizes need them.
+    """
+    records = []
+    i = 0
+    while i + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[i:i + 4])
+        if header_id != _ZIP64_EXTRA_ID:
+            records.append(extra[i:i + 4 + size])
+        i += 4 + size
+
+    return b''.join(records)
+
+
+def _can_copy_raw(dst: ZipFile):
+    return all(hasattr(dst, attr) for attr in ('fp', 'filelist', 'NameToInfo', 'start_dir', '_didModify'))
+
+
+def _copy_member(src: ZipFile, dst: ZipFile, name):
+    """
+    Append member `name` of `src` to `dst` as its raw compressed bytes, without decompressing it.
+
+    Writing raw bytes needs `ZipFile`'s internal state; on an implementation without it,
+    the member is decompressed and compressed again through the public API instead.
+    """
+    info = src.getinfo(name)
+    new_info = copy.copy(info)
+    new_info.extra = _without_zip64_extra(info.extra)
+
+    if not _can_copy_raw(dst):
+        with src.open(info) as f_src, dst.open(new_info, 'w', force_zip64=info.file_size > ZIP64_LIMIT) as f_dst:
+            shutil.copyfileobj(f_src, f_dst, 1 << 20)
+        return
+
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(_LOCAL_HEADER_SIZE)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    src.fp.seek(info.header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length)
+
+    new_info.flag_bits &= ~0x08     # Sizes go into the local header; no data descriptor
+    new_info.header_offset = dst.fp.tell()
+    dst.fp.write(new_info.FileHeader())
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src.fp.read(min(remaining, 1 << 20))
+        dst.fp.write(chunk)
+        remaining -= len(chunk)
+
+    dst.filelist.append(new_info)
+    dst.NameToInfo[name] = new_info
+    dst.start_dir = dst.fp.tell()
+    dst._didModify = True
 
 
 class Apkg(Anki):
-    def __init__(self, filename, **kwargs):
+    def __init__(self, filename, lazy=False, dedupe_media=False, **kwargs):
+        """
+        :param filename:
+        :param lazy: extract only collection.anki2, and read media files from the package when asked for
+        :param dedupe_media: store each distinct media payload once; see :meth:`media_dedupe_report`
+        :param kwargs:
+        """
         self.filename = str(filename)
         self.temp_dir = mkdtemp()
+        self.lazy = lazy
+        self._zip = None
         try:
-            with ZipFile(self.filename) as zf:
-                zf.extractall(path=self.temp_dir)
+            self._zip = ZipFile(self.filename)
+            if lazy:
+                self._zip.extract('collection.anki2', path=self.temp_dir)
+            else:
+                self._zip.extractall(path=self.temp_dir)
 
-            self.media = json.loads(Path(self.temp_dir).joinpath('media').read_text())
+            self.media = json.loads(self._zip.read('media')) if 'media' in self._zip.namelist() else dict()
         except FileNotFoundError:
             self.media = dict()
 
@@ -24,6 +111,12 @@ class Apkg(Anki):
 
         super(Apkg, self).__init__(str(Path(self.temp_dir).joinpath('collection.anki2')), **kwargs)
 
+        self._dirty_media = set()
+        self._media_dedup = None
+        self.dedupe_media = dedupe_media
+        self._index_media()
+        self._mark_saved()
+
     def __enter__(self):
         return self
 
@@ -32,37 +125,346 @@ class Apkg(Anki):
 
     def close(self):
         self.save()
+        super(Apkg, self).close()
+        if self._zip is not None:
+            self._zip.close()
         shutil.rmtree(self.temp_dir)
 
+    def _collection_stamp(self):
+        """
+        Rows changed so far through the collection's connection. A reconnect starts a new count,
+        so the connection is part of the stamp.
+        """
+        connection = self.db.database.connection()
+        return connection, connection.total_changes
+
+    def _mark_saved(self):
+        self._saved_collection = self._collection_stamp()
+        self._saved_media = dict(self.media)
+        self._dirty_media.clear()
+
+    @property
+    def is_dirty(self):
+        return self._zip is None \
+            or self._collection_stamp() != self._saved_collection \
+            or self.media != self._saved_media \
+            or bool(self._dirty_media) \
+            or (self._media_dedup is not None and bool(self._media_dedup.pending))
+
     def save(self):
-        with ZipFile(self.filename, 'w') as zf:
-            zf.write(str(Path(self.temp_dir).joinpath('collection.anki2')), arcname='collection.anki2')
-            for file_path in Path(self.temp_dir).glob('*'):
-                if str(Path(file_path).name).isdigit():
-                    zf.write(Path(self.temp_dir).joinpath(file_path).resolve(), arcname=file_path.name)
+        """
+        Write the package, if anything changed since it was opened or last saved.
+        Media files that were not stored anew are copied from the previous package as they are.
+        """
+        with self.profile('default'):
+            if self.dedupe_media:
+                self._ensure_media_dedup()
+            if self._media_dedup is not None and self._media_dedup.aliases \
+                    and (self._media_dedup.pending or self._collection_stamp() != self._saved_collection):
+                self._rewrite_media_aliases()
+
+            if not self.is_dirty:
+                return
+
+            temp_filename = self.filename + '.tmp'
+            with ZipFile(temp_filename, 'w') as zf:
+                zf.write(str(Path(self.temp_dir).joinpath('collection.anki2')), arcname='collection.anki2',
+                         compress_type=ZIP_DEFLATED)
+                for media_id, filename in self.media.items():
+                    if media_id not in self._dirty_media and self._in_zip(media_id):
+                        _copy_member(self._zip, zf, media_id)
+                    else:
+                        file_path = Path(self.temp_dir).joinpath(media_id)
+                        if file_path.exists():
+                            zf.write(str(file_path), arcname=media_id, compress_type=_compress_type(filename))
+
+                zf.writestr('media', json.dumps(self.media), compress_type=ZIP_DEFLATED)
+
+            if self._zip is not None:
+                self._zip.close()
+            os.replace(temp_filename, self.filename)
+            self._zip = ZipFile(self.filename)
+
+            self._mark_saved()
+
+    def _in_zip(self, media_id):
+        if self._zip is None:
+            return False
+
+        try:
+            self._zip.getinfo(media_id)
+            return True
+        except KeyError:
+            return False
+
+    def _open_media(self, media_id):
+        """
+        Binary stream of a media file, from the temporary folder, or straight from the package if opened lazily.
+        """
+        file_path = Path(self.temp_dir).joinpath(media_id)
+        if file_path.exists():
+            return file_path.open('rb')
 
-            zf.writestr('media', json.dumps(self.media))
+        return self._zip.open(media_id)
+
+    def _index_media(self):
+        self._media_ids = {filename: media_id for media_id, filename in self.media.items()}
+        self._next_media_id = max((int(k) for k in self.media.keys()), default=0) + 1
+
+    def _ensure_media_dedup(self):
+        """
+        Hash the media already in the package, in package order. Later files with the payload of an earlier one
+        become its aliases, and are dropped from the package on the next save.
+        """
+        if self._media_dedup is None:
+            self._media_dedup = MediaDedup()
+            for media_id, filename in sorted(self.media.items(), key=lambda item: int(item[0])):
+                with self._open_media(media_id) as f:
+                    data_binary = f.read()
+
+                digest, canonical = self._media_dedup.find(data_binary)
+                if canonical is None:
+                    self._media_dedup.add(filename, digest)
+                else:
+                    self.delete_media_file(filename)
+                    self._media_dedup.add_alias(filename, canonical, len(data_binary))
+
+        return self._media_dedup
+
+    def _rewrite_media_aliases(self):
+        """
+        Point the notes' references to duplicate media at the canonical filenames.
+        """
+        aliases = self._media_dedup.aliases
+        changes = dict()
+        for record in self.iter_notes(as_record=True):
+            fields = dict()
+            for name, value in record.fields.items():
+                new_value = rewrite_media_references(value, aliases)
+                if new_value != value:
+                    fields[name] = new_value
+            if fields:
+                changes[record.nid] = fields
+
+            if len(changes) >= DEFAULT_BATCH_SIZE:
+                self.update_notes_fields(changes)
+                changes = dict()
+
+        if changes:
+            self.update_notes_fields(changes)
+        self._media_dedup.pending.clear()
+
+    def media_dedupe_report(self):
+        """
+        :return: dict of files (distinct payloads), duplicates, bytes_saved and aliases (duplicate to canonical name)
+        """
+        if not self.dedupe_media:
+            raise ValueError('Media deduplication is not enabled; open with dedupe_media=True')
+
+        return self._ensure_media_dedup().report()
 
     def store_media_file(self, filename, data_binary):
-        if len(self.media.keys()) == 0:
-            media_id = 1
-        else:
-            media_id = max(int(k) for k in self.media.keys()) + 1
+        """
+        Add a media file, or replace the content of the media file of the same name.
 
-        with Path(self.temp_dir).joinpath(str(media_id)).open('wb') as f:
+        With `dedupe_media`, a payload that is already stored under another name is not written again;
+        references to `filename` in the notes are rewritten to that name on save.
+        Replacing the content of a file that others were deduplicated into also changes what they show.
+        """
+        digest = None
+        if self.dedupe_media:
+            dedup = self._ensure_media_dedup()
+            digest, canonical = dedup.find(data_binary)
+            if canonical is not None and canonical != filename:
+                if filename in self._media_ids:
+                    self.delete_media_file(filename)
+                dedup.add_alias(filename, canonical, len(data_binary))
+                return
+
+            dedup.aliases.pop(filename, None)
+            dedup.pending.discard(filename)
+
+        media_id = self._media_ids.get(filename)
+        if media_id is None:
+            media_id = str(self._next_media_id)
+            self._next_media_id += 1
+
+        with Path(self.temp_dir).joinpath(media_id).open('wb') as f:
             f.write(data_binary)
 
-        self.media[str(media_id)] = filename
+        self.media[media_id] = filename
+        self._media_ids[filename] = media_id
+        self._dirty_media.add(media_id)
+        if digest is not None:
+            self._media_dedup.add(filename, digest)
+
+    def store_media_files(self, files):
+        """
+        :param files: dict of filename to bytes, or iterable of (filename, bytes)
+        """
+        if isinstance(files, dict):
+            files = files.items()
+
+        for filename, data_binary in files:
+            self.store_media_file(filename, data_binary)
 
     def retrieve_media_file(self, filename):
-        for k, v in self.media.items():
-            if v == filename:
-                return Path(self.temp_dir).joinpath(k).read_bytes()
+        if self._media_dedup is not None:
+            filename = self._media_dedup.aliases.get(filename, filename)
+
+        media_id = self._media_ids.get(filename)
+        if media_id is not None:
+            with self._open_media(media_id) as f:
+                return f.read()
+
+    def retrieve_media_files(self, filenames):
+        """
+        :return: dict of filename to bytes, or None for unknown files
+        """
+        result = dict.fromkeys(filenames)
+        # In package order, so that a lazily opened package is read front to back
+        for filename in sorted((f for f in result.keys() if f in self._media_ids),
+                               key=lambda f: int(self._media_ids[f])):
+            result[filename] = self.retrieve_media_file(filename)
+
+        return result
 
     def delete_media_file(self, filename):
-        for k, v in self.media.items():
-            if v == filename:
-                self.media.pop(k)
+        if self._media_dedup is not None:
+            is_alias = filename in self._media_dedup.aliases
+            self._media_dedup.discard(filename)
+            if is_alias:
                 return True
 
-        return False
+        media_id = self._media_ids.pop(filename, None)
+        if media_id is None:
+            return False
+
+        self.media.pop(media_id)
+        self._dirty_media.discard(media_id)
+        file_path = Path(self.temp_dir).joinpath(media_id)
+        if file_path.exists():
+            file_path.unlink()
+
+        return True
+
+
+class ApkgWriter:
+    """
+    Builds a new package in one pass: notes go into a temp collection opened with the 'scratch' pragma profile,
+    chunk by chunk, and media are streamed straight into the output zip. Nothing is held in memory
+    beyond one chunk of notes.
+
+        with ApkgWriter('out.apkg', model=dict(name='Basic', fields=['Front', 'Back'],
+                                               templates={'Card 1': ('{{Front}}', '{{Back}}')})) as w:
+            w.add_media('a.jpg', b'...')
+            w.add_notes({'fields': {'Front': str(i), 'Back': '<img src="a.jpg">'}} for i in range(1000))
+    """
+    def __init__(self, filename, model: dict, deck='Default', chunk_size=DEFAULT_BATCH_SIZE, **kwargs):
+        """
+        :param filename:
+        :param model: as `first_model` of :meth:`Anki.init`
+        :param deck: deck of the notes without `deckName` or `deckId`
+        :param chunk_size: notes per transaction
+        :param kwargs: passed to :meth:`Anki.init`
+        """
+        self.filename = str(filename)
+        self.chunk_size = chunk_size
+        self.temp_dir = mkdtemp()
+        atexit.register(shutil.rmtree, self.temp_dir, ignore_errors=True)
+
+        self.anki = Anki(str(Path(self.temp_dir).joinpath('collection.anki2')), profile='scratch')
+        self.anki.init(first_model=dict(model), first_deck=deck, first_note_data=False, **kwargs)
+        self.model_id = self.anki.model_names_and_ids()[model['name']]
+        self.deck_id = self.anki.deck_names_and_ids()[deck]
+
+        self.media = dict()
+        self._zip = ZipFile(self.filename + '.tmp', 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_notes(self, notes, guid_fields=None):
+        """
+        :param notes: iterable of AnkiConnect-style notes; `modelId` defaults to the writer's model,
+        -- and the deck to the writer's deck
+        :param guid_fields: as in :meth:`Anki.add_notes`
+        :return: number of notes added
+        """
+        notes = iter(notes)
+        count = 0
+        while True:
+            chunk = list(islice(notes, self.chunk_size))
+            if not chunk:
+                break
+
+            entries = []
+            for ac_note in chunk:
+                if 'deckId' not in ac_note and 'deckName' not in ac_note:
+                    ac_note = dict(ac_note, deckId=self.deck_id)
+                entries.append((ac_note['fields'], ac_note.get('modelId', self.model_id), ac_note))
+
+            count += len(self.anki._insert_notes(entries, guid_fields=guid_fields))
+
+        return count
+
+    def add_media(self, filename, data):
+        """
+        :param filename:
+        :param data: bytes, or a binary file object to copy from
+        """
+        media_id = str(len(self.media) + 1)
+        info = ZipInfo(media_id, date_time=time.localtime()[:6])
+        info.compress_type = _compress_type(filename)
+
+        if isinstance(data, (bytes, bytearray)):
+            self._zip.writestr(info, data)
+        else:
+            with self._zip.open(info, 'w', force_zip64=True) as f:
+                shutil.copyfileobj(data, f)
+
+        self.media[media_id] = filename
+
+    def add_media_files(self, files):
+        """
+        :param files: dict of filename to data, or iterable of (filename, data); see :meth:`add_media`
+        """
+        if isinstance(files, dict):
+            files = files.items()
+
+        for filename, data in files:
+            self.add_media(filename, data)
+
+    def write(self, notes, media=(), guid_fields=None):
+        """
+        Add `media` and `notes`, then finish the package.
+        """
+        self.add_media_files(media)
+        self.add_notes(notes, guid_fields=guid_fields)
+        self.close()
+
+    def close(self):
+        self.anki.close()
+        self._zip.write(str(Path(self.temp_dir).joinpath('collection.anki2')), arcname='collection.anki2',
+                        compress_type=ZIP_DEFLATED)
+        self._zip.writestr('media', json.dumps(self.media), compress_type=ZIP_DEFLATED)
+        self._zip.close()
+
+        os.replace(self.filename + '.tmp', self.filename)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def abort(self):
+        """
+        Discard the package being written.
+        """
+        self.anki.close()
+        self._zip.close()
+
+        os.remove(self.filename + '.tmp')
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
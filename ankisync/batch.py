@@ -0,0 +1,98 @@
+import peewee as pv
+
+
+DEFAULT_BATCH_SIZE = 1000
+SQLITE_MAX_VARIABLE_NUMBER = 999
+
+
+def iter_keyset(query, key, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream the tuples of `query` in pages of `batch_size`, ordered by `key`, which must be the first column.
+
+    Each page is a fresh `WHERE key > last` query, so memory stays flat however large the table is.
+    """
+    last = None
+    while True:
+        page = query if last is None else query.where(key > last)
+        rows = list(page.order_by(key).limit(batch_size).tuples())
+
+        yield from rows
+
+        if len(rows) < batch_size:
+            break
+        last = rows[-1][0]
+
+
+def executemany(database, sql, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Run one prepared statement over `rows`, `batch_size` rows per `executemany` call.
+
+    :return: number of rows changed
+    """
+    cursor = database.cursor()
+    changed = 0
+    for chunk in pv.chunked(rows, batch_size):
+        cursor.executemany(sql, chunk)
+        changed += max(cursor.rowcount, 0)
+
+    return changed
+
+
+def insert_chunked(model, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Bulk INSERT of dicts through `executemany`, applying field converters and defaults like `insert_many`,
+    but without building SQL for every row.
+
+    :param model: peewee model class
+    :param rows: iterable of dicts of field name to Python value
+    """
+    fields = model._meta.sorted_fields
+    sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+        model._meta.table_name,
+        ', '.join('"{}"'.format(f.column_name) for f in fields),
+        ', '.join('?' for _ in fields)
+    )
+
+    # (name, converter, callable default, or the converted constant default)
+    columns = [(f.name, f.db_value, f.default if callable(f.default) else None,
+                None if callable(f.default) else f.db_value(f.default)) for f in fields]
+
+    def _gen_values():
+        for row in rows:
+            yield [db_value(row[name]) if name in row else (db_value(default()) if default else constant)
+                   for name, db_value, default, constant in columns]
+
+    return executemany(model._meta.database, sql, _gen_values(), batch_size)
+
+
+def chunked_ids(ids, size=SQLITE_MAX_VARIABLE_NUMBER):
+    """
+    Split `ids`, without duplicates, into lists short enough to bind in one `IN (...)`.
+    """
+    if size < 1:
+        raise ValueError('Chunk size must be positive, got {}'.format(size))
+
+    ids = list(dict.fromkeys(ids))
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def select_by_ids(query, field, ids):
+    """
+    Tuples of `query` restricted to `field IN ids`, one SELECT per chunk of ids.
+    """
+    for chunk in chunked_ids(ids):
+        yield from query.where(field.in_(chunk)).tuples()
+
+
+def update_by_ids(query, field, ids):
+    """
+    Run an UPDATE or DELETE `query` restricted to `field IN ids`, one statement per chunk of ids.
+
+    :return: number of rows changed
+    """
+    changed = 0
+    for chunk in chunked_ids(ids):
+        changed += query.where(field.in_(chunk)).execute()
+
+    return changed
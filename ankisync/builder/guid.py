@@ -4,6 +4,7 @@
 
 import random
 import string
+from hashlib import sha256
 
 _base91_extra_chars = "!#$%&()*+,-./:;<=>?@[]^_`{|}~"
 
@@ -41,3 +42,9 @@ def _incGuid(guid):
     else:
         guid = table[idx+1] + guid[1:]
     return guid
+
+
+def guid_for(*values):
+    "Return a base91-encoded 64bit guid derived from values, stable across re-imports."
+    digest = sha256('\x1f'.join(str(v) for v in values).encode('utf-8')).digest()
+    return base91(int.from_bytes(digest[:8], 'big'))
@@ -0,0 +1,72 @@
+from hashlib import sha1
+import json
+import os
+from time import time
+
+
+def row_digest(digest, row):
+    """
+    Feed one input row into a running `hashlib` digest, independently of dict ordering.
+    """
+    digest.update(json.dumps(row, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    digest.update(b'\n')
+
+
+def new_digest():
+    return sha1()
+
+
+class Checkpoints:
+    """
+    Progress of resumable jobs, one row per job name, kept in a side database attached as `ankisync_checkpoints`,
+    so that the collection, and any package exported from it, is left untouched.
+    The side database is only attached when a job is first looked up.
+
+    Saving happens inside the caller's transaction, which spans attached databases,
+    so a checkpoint is never ahead of the data it describes.
+    """
+    SCHEMA = 'ankisync_checkpoints'
+
+    def __init__(self, db, path):
+        self.db = db
+        self.path = str(path)
+        self.attached = False
+
+    def attach(self):
+        """
+        Attach the side database and create its table. Has to be called outside of a transaction.
+        """
+        if not self.attached:
+            self.db.database.attach(self.path, self.SCHEMA)
+            self.db.database.execute_sql(
+                'CREATE TABLE IF NOT EXISTS {}.checkpoints ('
+                'job TEXT PRIMARY KEY, '
+                'offset INTEGER NOT NULL, '
+                'hash TEXT NOT NULL, '
+                'mod INTEGER NOT NULL)'.format(self.SCHEMA))
+            self.attached = True
+
+    def get(self, job):
+        """
+        :return: (offset, hash) of the last committed chunk of `job`, or (0, None)
+        """
+        self.attach()
+        row = self.db.database.execute_sql(
+            'SELECT offset, hash FROM {}.checkpoints WHERE job = ?'.format(self.SCHEMA), (job,)).fetchone()
+        if row is None:
+            return 0, None
+
+        return row
+
+    def save(self, job, offset, hash_):
+        self.attach()
+        self.db.database.execute_sql(
+            'INSERT OR REPLACE INTO {}.checkpoints (job, offset, hash, mod) VALUES (?, ?, ?, ?)'.format(self.SCHEMA),
+            (job, offset, hash_, int(time())))
+
+    def delete(self, job):
+        if not self.attached and not os.path.exists(self.path):
+            return
+
+        self.attach()
+        self.db.database.execute_sql('DELETE FROM {}.checkpoints WHERE job = ?'.format(self.SCHEMA), (job,))
@@ -0,0 +1,93 @@
+class ColMeta:
+    """
+    Decoded snapshot of the single `col` row, with the lookups ankisync needs most often.
+
+    The dicts are shared between callers; treat them as read-only.
+    """
+    def __init__(self, db_col):
+        self.crt = db_col.crt
+        self.mod = db_col.mod
+        self.scm = db_col.scm
+        self.conf = db_col.conf
+        self.models = db_col.models
+        self.decks = db_col.decks
+        self.dconf = db_col.dconf
+        self.tags = db_col.tags
+
+        self.model_ids = {m['name']: int(mid) for mid, m in self.models.items()}
+        self.deck_ids = {d['name']: int(did) for did, d in self.decks.items()}
+        self.dconf_ids = {d['name']: int(dconf_id) for dconf_id, d in self.dconf.items()}
+
+        self.deck_names = {int(did): d['name'] for did, d in self.decks.items()}
+        self.field_names = dict()
+        self.template_names = dict()
+        self.field_index = dict()
+        for mid, m in self.models.items():
+            mid = int(mid)
+            self.field_names[mid] = [f['name'] for f in m['flds']]
+            self.template_names[mid] = [t['name'] for t in m['tmpls']]
+            self.field_index[mid] = {name: i for i, name in enumerate(self.field_names[mid])}
+
+
+class ColCache:
+    """
+    Keeps a :class:`ColMeta` until `Col.mod` or `Col.scm` changes, or until :meth:`invalidate` is called
+    after ankisync writes `Col` itself.
+
+    `Col.mod` only has a resolution of seconds, so the raw `col` row is compared with the one the snapshot
+    was decoded from before it is reused, whenever another connection has committed since, or `Col` was written
+    inside a transaction that may still roll back.
+    """
+    RAW_COLUMNS = ('conf', 'models', 'decks', 'dconf', 'tags')
+
+    def __init__(self, db):
+        self.db = db
+        self.hits = 0
+        self.misses = 0
+        self._meta = None
+        self._raw = None
+        self._stamp = None
+        self._uncommitted = False
+
+    def _read_stamp(self):
+        return self.db.database.execute_sql(
+            'SELECT mod, scm, (SELECT data_version FROM pragma_data_version) FROM col').fetchone()
+
+    def _read_raw(self):
+        return self.db.database.execute_sql(
+            'SELECT {} FROM col'.format(', '.join(self.RAW_COLUMNS))).fetchone()
+
+    def get(self) -> ColMeta:
+        stamp = self._read_stamp()
+        raw = None
+
+        if self._meta is not None and self._stamp[:2] == stamp[:2]:
+            if self._stamp == stamp and not self._uncommitted:
+                self.hits += 1
+                return self._meta
+
+            raw = self._read_raw()
+            if raw == self._raw:
+                self.hits += 1
+                self._stamp = stamp
+                self._uncommitted = self._uncommitted and self.db.database.in_transaction()
+                return self._meta
+
+        self.misses += 1
+        self._meta = ColMeta(self.db.Col.get())
+        self._raw = raw if raw is not None else self._read_raw()
+        self._stamp = stamp
+        self._uncommitted = self._uncommitted and self.db.database.in_transaction()
+
+        return self._meta
+
+    def invalidate(self):
+        self._meta = None
+        self._raw = None
+        self._uncommitted = self._uncommitted or self.db.database.in_transaction()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,100 @@
+import json
+
+from .anki_util import stripHTMLMedia
+from .batch import iter_keyset, chunked_ids, executemany
+
+
+class FullTextIndex:
+    """
+    Opt-in FTS5 index over the HTML-stripped text of every note, kept in a side database attached as `ankisync_fts`,
+    so that Anki's own schema is left untouched.
+
+    The side database also records a stamp of the notes table as of the last time the index was known to match it,
+    so that edits made while the index was not attached are noticed when it is next attached.
+    """
+    SCHEMA = 'ankisync_fts'
+
+    def __init__(self, db, path):
+        self.db = db
+        self.path = str(path)
+
+    def attach(self):
+        """
+        Attach the side database and create its tables.
+
+        :return: True if the index is new or out of date, and has to be rebuilt
+        """
+        self.db.database.attach(self.path, self.SCHEMA)
+        self.db.database.execute_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {}.notes_fts USING fts5(text, tokenize='unicode61 remove_diacritics 2')"
+            .format(self.SCHEMA))
+        self.db.database.execute_sql('CREATE TABLE IF NOT EXISTS {}.notes_stamp (stamp TEXT NOT NULL)'
+                                     .format(self.SCHEMA))
+
+        saved = self.db.database.execute_sql('SELECT stamp FROM {}.notes_stamp'.format(self.SCHEMA)).fetchone()
+        return saved is None or json.loads(saved[0]) != self._notes_stamp()
+
+    def _notes_stamp(self):
+        return list(self.db.database.execute_sql('SELECT COUNT(*), MAX(id), MAX(mod), TOTAL(mod) FROM notes')
+                    .fetchone())
+
+    def save_stamp(self):
+        """
+        Record that the index matches the notes table as it is now.
+        """
+        with self.db.database.atomic():
+            self.db.database.execute_sql('DELETE FROM {}.notes_stamp'.format(self.SCHEMA))
+            self.db.database.execute_sql('INSERT INTO {}.notes_stamp (stamp) VALUES (?)'.format(self.SCHEMA),
+                                         (json.dumps(self._notes_stamp()),))
+
+    def detach(self):
+        self.db.database.detach(self.SCHEMA)
+
+    @staticmethod
+    def note_text(flds):
+        return '\n'.join(stripHTMLMedia(f) for f in flds)
+
+    def rebuild(self):
+        with self.db.database.atomic():
+            self.db.database.execute_sql('DELETE FROM {}.notes_fts'.format(self.SCHEMA))
+            self.notes_changed(
+                (nid, flds) for nid, flds in iter_keyset(self.db.Notes.select(self.db.Notes.id, self.db.Notes.flds),
+                                                         self.db.Notes.id)
+            )
+            self.save_stamp()
+
+    def notes_changed(self, notes):
+        """
+        :param notes: iterable of (note id, list of fields)
+        """
+        with self.db.database.atomic():
+            executemany(self.db.database,
+                        'INSERT OR REPLACE INTO {}.notes_fts (rowid, text) VALUES (?, ?)'.format(self.SCHEMA),
+                        ((nid, self.note_text(flds)) for nid, flds in notes))
+
+    def notes_deleted(self, note_ids):
+        with self.db.database.atomic():
+            for chunk in chunked_ids(note_ids):
+                self.db.database.execute_sql(
+                    'DELETE FROM {}.notes_fts WHERE rowid IN ({})'.format(self.SCHEMA, ', '.join('?' for _ in chunk)),
+                    chunk)
+
+    def search(self, query, limit=None, raw=False):
+        """
+        :param query: words to look for; with `raw=True`, an FTS5 query expression
+        :param limit:
+        :param raw:
+        :return: note ids, best match first
+        """
+        if not raw:
+            query = ' '.join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+        if not query.strip():
+            return []
+
+        sql = 'SELECT rowid FROM {}.notes_fts WHERE notes_fts MATCH ? ORDER BY rank'.format(self.SCHEMA)
+        params = [query]
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        return [nid for nid, in self.db.database.execute_sql(sql, params)]
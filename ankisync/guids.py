@@ -0,0 +1,101 @@
+from hashlib import blake2b
+import math
+
+from .builder.guid import guid64
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings. May report false positives, never false negatives.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class GuidService:
+    """
+    Note guids of one collection, loaded once and then checked in memory.
+
+    :param read_existing: callable returning an iterable of the guids already in the collection
+    :param exists: callable checking one guid against the collection, used to confirm Bloom filter hits
+    """
+    def __init__(self, read_existing, exists):
+        self._read_existing = read_existing
+        self._exists = exists
+        self._bloom_args = None
+        self._bloom = None
+        self._seen = None
+
+    def use_bloom_filter(self, capacity, error_rate=0.001):
+        """
+        Keep guids in a Bloom filter instead of a set, to bound memory on very large collections.
+        Must be called before the first guid is generated.
+        """
+        self._bloom_args = (capacity, error_rate)
+        self._bloom = BloomFilter(capacity, error_rate)
+
+    def reset(self):
+        """
+        Load the guids again on next use, e.g. after another connection wrote to the notes table.
+        """
+        if self._bloom_args is not None:
+            self._bloom = BloomFilter(*self._bloom_args)
+        self._seen = None
+
+    def _ensure(self):
+        if self._seen is None:
+            self._seen = self._bloom if self._bloom is not None else set()
+            for guid in self._read_existing():
+                self._seen.add(guid)
+
+    def __contains__(self, guid):
+        self._ensure()
+        if guid not in self._seen:
+            return False
+        if self._seen is self._bloom:
+            return self._exists(guid)
+
+        return True
+
+    def new(self):
+        self._ensure()
+        guid = guid64()
+        while guid in self._seen:
+            guid = guid64()
+        self._seen.add(guid)
+
+        return guid
+
+    def new_batch(self, n):
+        return [self.new() for _ in range(n)]
+
+    def claim(self, guid):
+        """
+        Use `guid` if it is not taken yet, otherwise a new random guid.
+        """
+        if guid is None or guid in self:
+            return self.new()
+
+        self._seen.add(guid)
+        return guid
+
+    def add(self, guid):
+        self._ensure()
+        self._seen.add(guid)
+
@@ -0,0 +1,46 @@
+from time import time
+
+
+class IdAllocator:
+    """
+    Hands out strictly increasing, epoch-millisecond based ids for one table of one collection.
+
+    `read_max` is called on the first allocation, and again after :meth:`reset`, to find the largest id in use.
+    """
+    def __init__(self, read_max):
+        self._read_max = read_max
+        self._last = None
+
+    def _ensure(self):
+        if self._last is None:
+            self._last = self._read_max() or 0
+
+    def reset(self):
+        """
+        Read the largest id in use again on the next allocation, e.g. after another connection wrote to the table.
+        """
+        self._last = None
+
+    def next(self):
+        self._ensure()
+        self._last = max(self._last + 1, int(time() * 1000))
+        return self._last
+
+    def claim(self, preferred):
+        """
+        Use `preferred` if it is above every id handed out so far, otherwise the next free id.
+        """
+        self._ensure()
+        if preferred is not None and preferred > self._last:
+            self._last = preferred
+            return preferred
+
+        return self.next()
+
+    def reserve(self, value):
+        """
+        Make sure that ids up to `value`, which were assigned elsewhere, are not handed out.
+        """
+        self._ensure()
+        self._last = max(self._last, value)
+
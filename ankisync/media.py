@@ -0,0 +1,87 @@
+from hashlib import sha1
+import re
+from urllib.parse import quote, unquote
+
+_re_img = re.compile(r'''(?i)(<img[^>]*?\ssrc=)(?:"([^"]*)"|'([^']*)'|([^"'>\s]+))''')
+_re_sound = re.compile(r'\[sound:(.+?)\]')
+
+
+def rewrite_media_references(html, aliases):
+    """
+    Point `<img src=...>` and `[sound:...]` references to the names in `aliases` at their canonical names instead.
+
+    :param html: field content
+    :param aliases: dict of duplicate filename to canonical filename
+    """
+    def _rename(name):
+        canonical = aliases.get(name)
+        if canonical is not None:
+            return canonical
+
+        canonical = aliases.get(unquote(name))
+        if canonical is not None:
+            return quote(canonical)
+
+        return name
+
+    def _rename_img(m):
+        for quote_char, group in (('"', 2), ("'", 3), ('', 4)):
+            if m.group(group) is not None:
+                return '{}{}{}{}'.format(m.group(1), quote_char, _rename(m.group(group)), quote_char)
+
+    html = _re_img.sub(_rename_img, html)
+    return _re_sound.sub(lambda m: '[sound:{}]'.format(_rename(m.group(1))), html)
+
+
+class MediaDedup:
+    """
+    SHA-1 of every distinct media payload of a package, and the filenames that turned out to duplicate another.
+    """
+    def __init__(self):
+        self.canonical = dict()     # sha1 to filename
+        self.sha1_by_name = dict()
+        self.aliases = dict()       # duplicate filename to canonical filename
+        self.pending = set()        # aliases not rewritten in the notes yet
+        self.bytes_saved = 0
+
+    def find(self, data):
+        """
+        :return: checksum of `data`, and the filename already holding the same payload, or None
+        """
+        digest = sha1(data).hexdigest()
+        return digest, self.canonical.get(digest)
+
+    def add(self, filename, digest):
+        old = self.sha1_by_name.pop(filename, None)
+        if old is not None and self.canonical.get(old) == filename:
+            self.canonical.pop(old)
+
+        self.canonical.setdefault(digest, filename)
+        self.sha1_by_name[filename] = digest
+
+    def add_alias(self, filename, canonical, size):
+        self.aliases[filename] = canonical
+        self.pending.add(filename)
+        self.bytes_saved += size
+
+    def discard(self, filename):
+        """
+        Forget `filename`, and the aliases pointing at it.
+        """
+        self.aliases.pop(filename, None)
+        self.pending.discard(filename)
+
+        digest = self.sha1_by_name.pop(filename, None)
+        if digest is not None and self.canonical.get(digest) == filename:
+            self.canonical.pop(digest)
+        for alias in [k for k, v in self.aliases.items() if v == filename]:
+            self.aliases.pop(alias)
+            self.pending.discard(alias)
+
+    def report(self):
+        return {
+            'files': len(self.canonical),
+            'duplicates': len(self.aliases),
+            'bytes_saved': self.bytes_saved,
+            'aliases': dict(self.aliases)
+        }
@@ -0,0 +1,139 @@
+import warnings
+
+PROFILES = {
+    # What Anki itself expects to find when it opens the file. `PragmaProfiles` restores the values the collection
+    # was actually opened with instead, so that e.g. a collection in WAL mode stays in WAL mode.
+    'default': {
+        'journal_mode': 'delete',
+        'synchronous': 2,
+        'cache_size': -2000,
+        'temp_store': 0,
+        'mmap_size': 0,
+        'query_only': 0,
+        'locking_mode': 'normal',
+        'foreign_keys': 0
+    },
+    # Large imports into a user's collection. The rollback journal stays on disk, so a crashed or killed process
+    # leaves the collection as of the last commit; only an OS crash or power loss in the middle of a write can corrupt it
+    'bulk': {
+        'journal_mode': 'delete',
+        'synchronous': 0,
+        'cache_size': -256 * 1024,
+        'temp_store': 2,
+        'mmap_size': 0,
+        'query_only': 0,
+        'locking_mode': 'normal',
+        'foreign_keys': 0
+    },
+    # Throwaway collections only, e.g. the one `ApkgWriter` builds in a temp dir: with the journal in memory,
+    # `atomic()` rollbacks still work, but a crash in the middle of a write corrupts the file
+    'scratch': {
+        'journal_mode': 'memory',
+        'synchronous': 0,
+        'cache_size': -256 * 1024,
+        'temp_store': 2,
+        'mmap_size': 0,
+        'query_only': 0,
+        'locking_mode': 'normal',
+        'foreign_keys': 0
+    },
+    # Analytics on a collection that nobody else writes to meanwhile
+    'read': {
+        'journal_mode': 'delete',
+        'synchronous': 2,
+        'cache_size': -256 * 1024,
+        'temp_store': 2,
+        'mmap_size': 1024 ** 3,
+        'query_only': 1,
+        'locking_mode': 'exclusive',
+        'foreign_keys': 0
+    }
+}
+
+# Secondary indexes that ankisync's own write paths do not read, so they can be dropped during bulk writes
+# and rebuilt once at the end
+DEFERRED_INDEXES = {
+    'bulk': ('ix_notes_usn', 'ix_notes_csum', 'ix_cards_usn', 'ix_cards_sched', 'ix_revlog_usn'),
+    'scratch': ('ix_notes_usn', 'ix_notes_csum', 'ix_cards_usn', 'ix_cards_sched', 'ix_revlog_usn')
+}
+
+# Anki's own definitions of the deferred indexes, to recreate them if a session never got to restore them
+INDEX_SQL = {
+    'ix_notes_usn': ('notes', 'CREATE INDEX IF NOT EXISTS ix_notes_usn ON notes (usn)'),
+    'ix_notes_csum': ('notes', 'CREATE INDEX IF NOT EXISTS ix_notes_csum ON notes (csum)'),
+    'ix_cards_usn': ('cards', 'CREATE INDEX IF NOT EXISTS ix_cards_usn ON cards (usn)'),
+    'ix_cards_sched': ('cards', 'CREATE INDEX IF NOT EXISTS ix_cards_sched ON cards (did, queue, due)'),
+    'ix_revlog_usn': ('revlog', 'CREATE INDEX IF NOT EXISTS ix_revlog_usn ON revlog (usn)')
+}
+
+
+class PragmaProfiles:
+    """
+    Switches the connection between the pragma sets of :data:`PROFILES`,
+    dropping the profile's :data:`DEFERRED_INDEXES` while it is active.
+
+    The 'default' profile restores the values read when the collection was opened. Deferred indexes that are
+    missing when the collection is opened, because an earlier session crashed or was never closed, are recreated.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.current = 'default'
+        self._dropped = dict()
+        self.opened = {key: self.db.database.pragma(key) for key in PROFILES['default']}
+        self.restore_missing_indexes()
+
+    def restore_missing_indexes(self):
+        tables, indexes = self._schema_names()
+        missing = [sql for name, (table, sql) in INDEX_SQL.items() if table in tables and name not in indexes]
+        if not missing:
+            return
+
+        try:
+            with self.db.database.atomic():
+                for sql in missing:
+                    self.db.database.execute_sql(sql)
+        except Exception as e:
+            warnings.warn('Could not recreate missing Anki indexes: {}'.format(e))
+
+    def _schema_names(self):
+        rows = self.db.database.execute_sql(
+            "SELECT type, name FROM sqlite_master WHERE type IN ('table', 'index')").fetchall()
+        return {name for type_, name in rows if type_ == 'table'}, {name for type_, name in rows if type_ == 'index'}
+
+    def apply(self, name):
+        if name not in PROFILES:
+            raise ValueError('Unknown pragma profile: {}; expected one of {}'.format(name, sorted(PROFILES)))
+
+        deferred = DEFERRED_INDEXES.get(name, ())
+        if self._dropped or deferred:
+            self.db.database.pragma('query_only', 0, permanent=True)
+            self._restore_indexes(keep=deferred)
+
+        for key, value in (self.opened if name == 'default' else PROFILES[name]).items():
+            self.db.database.pragma(key, value, permanent=True)
+        # Leaving exclusive locking mode only takes effect on the next access to the file
+        self.db.database.execute_sql('SELECT count(*) FROM sqlite_master').fetchone()
+
+        self._drop_indexes(deferred)
+        self.current = name
+
+    def _drop_indexes(self, names):
+        names = [name for name in names if name not in self._dropped]
+        if not names:
+            return
+
+        with self.db.database.atomic():
+            for name, sql in self.db.database.execute_sql(
+                    "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name IN ({})"
+                    .format(', '.join('?' for _ in names)), names).fetchall():
+                self.db.database.execute_sql('DROP INDEX "{}"'.format(name))
+                self._dropped[name] = sql
+
+    def _restore_indexes(self, keep=()):
+        _, indexes = self._schema_names()
+        with self.db.database.atomic():
+            for name in [name for name in self._dropped if name not in keep]:
+                sql = self._dropped.pop(name)
+                # Another connection may have recreated it meanwhile
+                if name not in indexes:
+                    self.db.database.execute_sql(sql)
@@ -0,0 +1,30 @@
+class NoteRecord:
+    """
+    Compact note row yielded by ``Anki.iter_notes(as_record=True)``.
+
+    `field_names` is shared between every record of the same model.
+    """
+    __slots__ = ('nid', 'mid', 'flds', 'tags', 'field_names')
+
+    def __init__(self, nid, mid, flds, tags, field_names):
+        self.nid = nid
+        self.mid = mid
+        self.flds = flds
+        self.tags = tags
+        self.field_names = field_names
+
+    @property
+    def fields(self):
+        return dict(zip(self.field_names, self.flds))
+
+    def to_dict(self):
+        return {
+            '_nid': self.nid,
+            '_mid': self.mid,
+            **self.fields,
+            '_tags': self.tags
+        }
+
+    def __repr__(self):
+        return 'NoteRecord(nid={!r}, mid={!r}, fields={!r}, tags={!r})'.format(
+            self.nid, self.mid, self.fields, self.tags)
@@ -0,0 +1,77 @@
+import operator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CARD_TYPES = (0, 1, 2, 3)
+CARD_QUEUES = (-3, -2, -1, 0, 1, 2, 3)
+SCHEDULE_COLUMNS = ('id', 'type', 'queue', 'due', 'ivl', 'factor')
+
+
+def _invalid(column, i, value):
+    return ValueError('Invalid {} {!r} at row {}'.format(column, value, i))
+
+
+def _validate_numpy(arr):
+    if arr.ndim != 2 or arr.shape[1] not in (4, 6):
+        raise ValueError('Expected rows of (card_id, type, queue, due[, ivl, factor]), got shape {}'
+                         .format(arr.shape))
+    if not np.issubdtype(arr.dtype, np.integer):
+        raise ValueError('Expected integers, got {}'.format(arr.dtype))
+
+    checks = [(1, ~np.isin(arr[:, 1], CARD_TYPES)), (2, ~np.isin(arr[:, 2], CARD_QUEUES))]
+    if arr.shape[1] == 6:
+        checks.append((5, arr[:, 5] < 0))
+    for column, bad in checks:
+        if bad.any():
+            i = int(np.argmax(bad))
+            raise _invalid(SCHEDULE_COLUMNS[column], i, arr[i, column])
+
+    ids, counts = np.unique(arr[:, 0], return_counts=True)
+    if (counts > 1).any():
+        raise ValueError('Duplicate card id {}'.format(ids[np.argmax(counts > 1)]))
+
+    return arr.tolist()
+
+
+def _validate_python(rows):
+    rows = [tuple(row) for row in rows]
+    width = len(rows[0]) if rows else 4
+    seen = set()
+
+    for i, row in enumerate(rows):
+        if len(row) != width or width not in (4, 6):
+            raise ValueError('Expected rows of (card_id, type, queue, due[, ivl, factor]), got {!r} at row {}'
+                             .format(row, i))
+        for column, value in zip(SCHEDULE_COLUMNS, row):
+            try:
+                operator.index(value)
+            except TypeError:
+                raise _invalid(column, i, value)
+        row = rows[i] = tuple(operator.index(value) for value in row)
+        if row[1] not in CARD_TYPES:
+            raise _invalid('type', i, row[1])
+        if row[2] not in CARD_QUEUES:
+            raise _invalid('queue', i, row[2])
+        if width == 6 and row[5] < 0:
+            raise _invalid('factor', i, row[5])
+        if row[0] in seen:
+            raise ValueError('Duplicate card id {}'.format(row[0]))
+        seen.add(row[0])
+
+    return rows
+
+
+def validate_schedule(rows):
+    """
+    Check scheduling rows of (card_id, type, queue, due) or (card_id, type, queue, due, ivl, factor),
+    column-wise with NumPy if it is installed and `rows` is an array.
+
+    :return: list of rows of Python ints
+    """
+    if np is not None and isinstance(rows, np.ndarray):
+        return _validate_numpy(rows)
+
+    return _validate_python(rows)
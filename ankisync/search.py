@@ -0,0 +1,319 @@
+"""
+Compiler from Anki's search syntax to parameterised SQL over `notes` and `cards`.
+
+Supported: plain text, `field:value`, `deck:`, `tag:`, `note:`, `card:`, `is:`, `prop:`, `nid:`, `cid:`, `mid:`,
+`dupe:`, `*` and `_` wildcards, `-` negation, `or`, `and` and parentheses.
+"""
+from functools import lru_cache, reduce
+import operator
+import re
+from time import time
+
+import peewee as pv
+
+from . import anki_db
+from .anki_util import field_checksum, stripHTMLMedia
+
+RESERVED_KEYS = {'deck', 'tag', 'note', 'card', 'is', 'prop', 'nid', 'cid', 'mid', 'dupe'}
+PROPERTIES = {'ivl', 'due', 'reps', 'lapses', 'ease'}
+
+_re_prop = re.compile(r'^(\w+)(<=|>=|!=|=|<|>)(-?\d+(?:\.\d+)?)$')
+
+
+class SearchError(ValueError):
+    pass
+
+
+def _tokenize(query):
+    """
+    :return: list of '(', ')', '-', or (text, quoted) pairs
+    """
+    tokens = []
+    i = 0
+    while i < len(query):
+        c = query[i]
+        if c.isspace():
+            i += 1
+        elif c in '()':
+            tokens.append(c)
+            i += 1
+        elif c == '-' and i + 1 < len(query) and not query[i + 1].isspace():
+            tokens.append('-')
+            i += 1
+        else:
+            buf = []
+            quoted = False
+            while i < len(query) and not query[i].isspace() and query[i] not in '()':
+                if query[i] == '"':
+                    quoted = True
+                    end = query.find('"', i + 1)
+                    if end == -1:
+                        end = len(query)
+                    buf.append(query[i + 1:end])
+                    i = end + 1
+                else:
+                    buf.append(query[i])
+                    i += 1
+            tokens.append((''.join(buf), quoted))
+
+    return tokens
+
+
+@lru_cache(maxsize=256)
+def parse(query: str):
+    """
+    Parse a search string into a tree of tuples: ('and', [...]), ('or', [...]), ('not', node) and
+    ('term', key, value), where `key` is None for plain text.
+
+    The result is cached, so repeated queries skip the parser.
+    """
+    tokens = _tokenize(query)
+    pos = 0
+
+    def _peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def _is_word(token, word):
+        return isinstance(token, tuple) and not token[1] and token[0].lower() == word
+
+    def _expr():
+        nonlocal pos
+        parts = [_and_expr()]
+        while _is_word(_peek(), 'or'):
+            pos += 1
+            parts.append(_and_expr())
+
+        return parts[0] if len(parts) == 1 else ('or', tuple(parts))
+
+    def _and_expr():
+        nonlocal pos
+        parts = []
+        while True:
+            token = _peek()
+            if token is None or token == ')' or _is_word(token, 'or'):
+                break
+            if _is_word(token, 'and'):
+                pos += 1
+                continue
+            parts.append(_unary())
+
+        if not parts:
+            raise SearchError('Empty expression in {!r}'.format(query))
+
+        return parts[0] if len(parts) == 1 else ('and', tuple(parts))
+
+    def _unary():
+        nonlocal pos
+        token = _peek()
+        if token is None or token == ')':
+            raise SearchError('Expected a search term at {!r} in {!r}'.format(token or 'end', query))
+        pos += 1
+        if token == '-':
+            return 'not', _unary()
+        if token == '(':
+            node = _expr()
+            if _peek() != ')':
+                raise SearchError('Missing ) in {!r}'.format(query))
+            pos += 1
+            return node
+
+        return _term(token[0])
+
+    def _term(text):
+        key, sep, value = text.partition(':')
+        if sep and key:
+            return 'term', key.lower() if key.lower() in RESERVED_KEYS else key, value
+
+        return 'term', None, text
+
+    if not tokens:
+        return 'and', ()
+
+    node = _expr()
+    if pos < len(tokens):
+        raise SearchError('Unexpected {!r} in {!r}'.format(tokens[pos], query))
+
+    return node
+
+
+def _like_pattern(text, contains=False):
+    text = text.replace('\\', '\\\\').replace('%', '\\%').replace('*', '%')
+    if contains:
+        text = '%{}%'.format(text)
+
+    return text
+
+
+def _like(lhs, pattern):
+    return pv.NodeList((lhs, pv.SQL('LIKE'), pv.Value(pattern, converter=False), pv.SQL("ESCAPE '\\'")))
+
+
+def _name_matches(pattern, names):
+    regex = re.compile('^{}$'.format(re.escape(pattern).replace(r'\*', '.*').replace('_', '.')), re.IGNORECASE)
+    return [name for name in names if regex.match(name)]
+
+
+_FALSE = pv.SQL('0')
+_TRUE = pv.SQL('1')
+
+
+class SearchCompiler:
+    """
+    Turns parsed searches into peewee expressions over `cards` joined to `notes`,
+    resolving deck, model and template names through the Col metadata cache.
+    """
+    def __init__(self, anki):
+        self.anki = anki
+
+    def where(self, query: str):
+        return self._compile(parse(query), self.anki.col_cache.get())
+
+    def notes_query(self, query: str):
+        return self.anki.db.Notes.select(self.anki.db.Notes.id).distinct()\
+            .join(self.anki.db.Cards, on=(self.anki.db.Cards.nid == self.anki.db.Notes.id))\
+            .where(self.where(query))
+
+    def cards_query(self, query: str):
+        return self.anki.db.Cards.select(self.anki.db.Cards.id)\
+            .join(self.anki.db.Notes, on=(self.anki.db.Cards.nid == self.anki.db.Notes.id))\
+            .where(self.where(query))
+
+    def explain(self, query: str, cards=False):
+        """
+        :return: the `EXPLAIN QUERY PLAN` rows of the compiled query
+        """
+        sql, params = (self.cards_query(query) if cards else self.notes_query(query)).sql()
+        return [row[-1] for row in self.anki.db.database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)]
+
+    def _compile(self, node, col):
+        kind = node[0]
+        if kind == 'and':
+            return reduce(operator.and_, (self._compile(n, col) for n in node[1]), _TRUE)
+        if kind == 'or':
+            return reduce(operator.or_, (self._compile(n, col) for n in node[1]), _FALSE)
+        if kind == 'not':
+            return ~self._compile(node[1], col)
+
+        _, key, value = node
+        if key is None:
+            return _like(self.anki.db.Notes.flds, _like_pattern(value, contains=True))
+
+        method = getattr(self, '_search_{}'.format(key), None) if key in RESERVED_KEYS else None
+        if method is None:
+            return self._search_field(key, value, col)
+
+        return method(value, col)
+
+    def _search_deck(self, value, col):
+        names = _name_matches(value, col.deck_ids.keys())
+        names += _name_matches(value + '::*', col.deck_ids.keys())
+        deck_ids = sorted({col.deck_ids[name] for name in names})
+        if not deck_ids:
+            return _FALSE
+
+        # Only `did`, not `odid` as well, so that SQLite can use ix_cards_sched
+        return self.anki.db.Cards.did.in_(deck_ids)
+
+    def _search_tag(self, value, col):
+        if not value:
+            raise SearchError('Empty tag: search')
+        if value.lower() == 'none':
+            return pv.fn.trim(self.anki.db.Notes.tags) == ''
+
+        return anki_db.tags_like(self.anki.db.Notes, value.replace('*', '%'))
+
+    def _search_note(self, value, col):
+        model_ids = [col.model_ids[name] for name in _name_matches(value, col.model_ids.keys())]
+        if not model_ids:
+            return _FALSE
+
+        return self.anki.db.Notes.mid.in_(model_ids)
+
+    def _search_card(self, value, col):
+        if value.isdigit():
+            return self.anki.db.Cards.ord == int(value) - 1
+
+        parts = []
+        for mid, template_names in col.template_names.items():
+            for ord_ in (template_names.index(name) for name in _name_matches(value, template_names)):
+                parts.append((self.anki.db.Notes.mid == mid) & (self.anki.db.Cards.ord == ord_))
+
+        return reduce(operator.or_, parts, _FALSE)
+
+    def _search_is(self, value, col):
+        value = value.lower()
+        if value == 'due':
+            today = int((time() - col.crt) // 86400)
+            return (self.anki.db.Cards.queue.in_([2, 3]) & (self.anki.db.Cards.due <= today)) | \
+                ((self.anki.db.Cards.queue == 1) & (self.anki.db.Cards.due <= int(time())))
+        if value == 'new':
+            return self.anki.db.Cards.type == 0
+        if value == 'learn':
+            return self.anki.db.Cards.queue.in_([1, 3])
+        if value == 'review':
+            return self.anki.db.Cards.type.in_([2, 3])
+        if value == 'suspended':
+            return self.anki.db.Cards.queue == -1
+        if value == 'buried':
+            return self.anki.db.Cards.queue.in_([-2, -3])
+
+        raise SearchError('Unknown is:{}'.format(value))
+
+    def _search_prop(self, value, col):
+        m = _re_prop.match(value)
+        if m is None or m.group(1) not in PROPERTIES:
+            raise SearchError('Invalid prop:{}'.format(value))
+
+        prop, op, number = m.groups()
+        if prop == 'ease':
+            lhs, rhs = self.anki.db.Cards.factor, int(float(number) * 1000)
+        elif prop == 'due':
+            today = int((time() - col.crt) // 86400)
+            lhs, rhs = self.anki.db.Cards.due, today + int(number)
+        else:
+            lhs, rhs = getattr(self.anki.db.Cards, prop), int(number)
+
+        expr = pv.Expression(lhs, '!=' if op == '!=' else op, rhs)
+        if prop == 'due':
+            expr = self.anki.db.Cards.queue.in_([2, 3]) & expr
+
+        return expr
+
+    @staticmethod
+    def _ids(value):
+        try:
+            return [int(v) for v in value.split(',') if v]
+        except ValueError:
+            raise SearchError('Invalid id list: {}'.format(value))
+
+    def _search_nid(self, value, col):
+        return self.anki.db.Notes.id.in_(self._ids(value))
+
+    def _search_cid(self, value, col):
+        return self.anki.db.Cards.id.in_(self._ids(value))
+
+    def _search_mid(self, value, col):
+        return self.anki.db.Notes.mid.in_(self._ids(value))
+
+    def _search_dupe(self, value, col):
+        mid, _, text = value.partition(',')
+        try:
+            mid = int(mid)
+        except ValueError:
+            raise SearchError('Invalid dupe:{}; expected dupe:<model id>,<text>'.format(value))
+        csum = field_checksum(stripHTMLMedia(text))
+
+        return (self.anki.db.Notes.mid == mid) & (self.anki.db.Notes.csum == csum) & \
+            (self.anki.db.Notes.sfld == stripHTMLMedia(text))
+
+    def _search_field(self, name, value, col):
+        parts = []
+        for mid, field_index in col.field_index.items():
+            for field_name, i in field_index.items():
+                if field_name.lower() != name.lower():
+                    continue
+
+                parts.append((self.anki.db.Notes.mid == mid) &
+                             _like(pv.fn.ankisync_field(self.anki.db.Notes.flds, i), _like_pattern(value)))
+
+        return reduce(operator.or_, parts, _FALSE)
@@ -0,0 +1,90 @@
+from .batch import iter_keyset
+
+
+def _tag_set(tags):
+    return {tag for tag in tags if tag}
+
+
+class TagIndex:
+    """
+    Tag to note ids mapping, built once from the notes table and then kept up to date by ankisync's own writes.
+    Tags added by those writes are registered in `Col.tags`, Anki's tag cache; building the index never writes.
+
+    The index is rebuilt when another connection has committed to the collection since it was last used.
+    """
+    def __init__(self, anki):
+        self.anki = anki
+        self._note_ids = None
+        self._data_version = None
+
+    def rebuild(self):
+        note_ids = dict()
+        for nid, tags in iter_keyset(self.anki.db.Notes.select(self.anki.db.Notes.id, self.anki.db.Notes.tags), self.anki.db.Notes.id):
+            for tag in _tag_set(tags):
+                note_ids.setdefault(tag, set()).add(nid)
+
+        self._note_ids = note_ids
+
+    def invalidate(self):
+        """
+        Drop the index, to be rebuilt on next use.
+        """
+        self._note_ids = None
+
+    def _ensure(self):
+        data_version = self.anki.db.data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._note_ids = None
+
+        if self._note_ids is None:
+            self.rebuild()
+
+    def tags(self):
+        self._ensure()
+        return sorted(self._note_ids.keys())
+
+    def note_ids(self, tag):
+        self._ensure()
+        return sorted(self._note_ids.get(tag, ()))
+
+    def notes_changed(self, changes):
+        """
+        :param changes: iterable of (note id, tags before, tags after); use empty tags for added or deleted notes
+        """
+        changes = [(nid, _tag_set(before), _tag_set(after)) for nid, before, after in changes]
+        if self._note_ids is not None:
+            for nid, before, after in changes:
+                for tag in before - after:
+                    nids = self._note_ids.get(tag)
+                    if nids is not None:
+                        nids.discard(nid)
+                        if not nids:
+                            self._note_ids.pop(tag)
+                for tag in after - before:
+                    self._note_ids.setdefault(tag, set()).add(nid)
+
+        new_tags = set()
+        for _, _, after in changes:
+            new_tags.update(after)
+        self.save(extra=new_tags)
+
+    def save(self, prune=False, extra=()):
+        """
+        Write the tag list into `Col.tags`, if it differs.
+
+        :param prune: also drop tags that no note uses anymore, including tags Anki registered itself;
+        -- only possible once the index is built
+        :param extra: tags to register even if the index is not built
+        """
+        col = self.anki.col_cache.get()
+        wanted = set(col.tags.keys()) | set(extra)
+        if self._note_ids is not None:
+            wanted |= set(self._note_ids.keys())
+            if prune:
+                wanted &= set(self._note_ids.keys())
+
+        if wanted != set(col.tags.keys()):
+            db_col = self.anki.db.Col.get()
+            db_col.tags = {tag: db_col.tags.get(tag, db_col.usn) for tag in sorted(wanted)}
+            self.anki._save_col(db_col)
@@ -0,0 +1,92 @@
+class NoteIndex:
+    """
+    Hash index of the notes of one model, keyed on the string values of `match_fields`.
+    """
+    def __init__(self, match_fields):
+        self.match_fields = tuple(match_fields)
+        self.nids_by_key = dict()
+        self.key_by_nid = dict()
+
+    def key(self, fields: dict):
+        return tuple(str(fields.get(k, '')) for k in self.match_fields)
+
+    def add(self, nid, fields: dict):
+        key = self.key(fields)
+        self.nids_by_key.setdefault(key, []).append(nid)
+        self.key_by_nid[nid] = key
+
+    def discard(self, nid):
+        key = self.key_by_nid.pop(nid, None)
+        if key is not None:
+            nids = self.nids_by_key[key]
+            nids.remove(nid)
+            if not nids:
+                self.nids_by_key.pop(key)
+
+    def find(self, fields: dict):
+        return list(self.nids_by_key.get(self.key(fields), []))
+
+
+class UpsertIndex:
+    """
+    Lazily built :class:`NoteIndex`'es, one per (model id, match fields), kept up to date by ankisync's
+    note writes. Also counts the rows inserted and updated by upserts.
+
+    The indexes are dropped when another connection has committed to the collection since they were last used.
+    """
+    def __init__(self, anki):
+        self.anki = anki
+        self.inserted = 0
+        self.updated = 0
+        self._indexes = dict()
+        self._data_version = None
+
+    def get(self, model_id, match_fields) -> NoteIndex:
+        model_id = int(model_id)
+        match_fields = tuple(match_fields)
+
+        data_version = self.anki.db.data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.clear()
+
+        index = self._indexes.get((model_id, match_fields))
+        if index is None:
+            index = NoteIndex(match_fields)
+            for record in self.anki.iter_notes(model_id=model_id, as_record=True):
+                index.add(record.nid, record.fields)
+            self._indexes[(model_id, match_fields)] = index
+
+        return index
+
+    def _model_indexes(self, model_id):
+        model_id = int(model_id)
+        for (mid, _), index in self._indexes.items():
+            if mid == model_id:
+                yield index
+
+    def note_added(self, nid, model_id, fields: dict):
+        for index in self._model_indexes(model_id):
+            index.add(nid, fields)
+
+    def note_updated(self, nid, model_id, fields: dict):
+        """
+        :param fields: all the fields of the note after the update
+        """
+        for index in self._model_indexes(model_id):
+            index.discard(nid)
+            index.add(nid, fields)
+
+    def note_deleted(self, nid, model_id):
+        for index in self._model_indexes(model_id):
+            index.discard(nid)
+
+    def clear(self):
+        self._indexes.clear()
+
+    def stats(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'indexes': len(self._indexes)
+        }
@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from ankisync.apkg import Apkg
+
+
+def legacy_iter_cards(db):
+    """The per-card Notes.get + Col.get() path that iter_cards used to take."""
+    for db_card in db.Cards.select():
+        db_note = db.Notes.get(id=db_card.nid)
+        db_col = db.Col.get()
+        db_model = db_col.models[str(db_note.mid)]
+        template_names = [t['name'] for t in db_model['tmpls']]
+        try:
+            template = template_names[db_card.ord]
+        except IndexError:
+            template = template_names[0]
+
+        d = dict(zip([f['name'] for f in db_model['flds']], db_note.flds))
+        d.update(
+            tags=db_note.tags,
+            deck=db_col.decks[str(db_card.did)]['name'],
+            model=db_model['name'],
+            template=template,
+            order=db_card.ord
+        )
+        yield d
+
+
+def timed(name, it):
+    start = default_timer()
+    count = sum(1 for _ in it)
+    elapsed = default_timer() - start
+    print('{:<12} {:>8} cards {:>8.2f}s {:>10.0f} cards/s'.format(name, count, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    number_of_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with Apkg(Path(mkdtemp()).joinpath('bench.apkg')) as a:
+        a.init(
+            first_model=dict(
+                name='bench',
+                fields=['front', 'back'],
+                templates={
+                    'Forward': ('{{front}}', '{{back}}'),
+                    'Reverse': ('{{back}}', '{{front}}')
+                }
+            ),
+            first_deck='bench',
+            first_note_data=False
+        )
+        model_id = a.model_names_and_ids()['bench']
+        deck_id = a.deck_names_and_ids()['bench']
+        a.add_notes({
+            'modelId': model_id,
+            'deckId': deck_id,
+            'fields': {
+                'front': 'front {}'.format(i),
+                'back': 'back {}'.format(i)
+            },
+            'tags': ['bench']
+        } for i in range(number_of_notes))
+
+        timed('legacy', legacy_iter_cards(a.db))
+        timed('iter_cards', a.iter_cards())
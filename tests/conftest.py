@@ -0,0 +1,40 @@
+import pytest
+
+from ankisync.anki import Anki
+
+BASIC = dict(name='Basic', fields=['Front', 'Back'], templates={'Card 1': ('{{Front}}', '{{Back}}')})
+
+
+def basic_model():
+    return dict(BASIC, fields=list(BASIC['fields']), templates=dict(BASIC['templates']))
+
+
+@pytest.fixture
+def anki2_path(tmp_path):
+    path = str(tmp_path / 'collection.anki2')
+    with Anki(path) as anki:
+        anki.init(first_model=basic_model(), first_note_data=False)
+
+    return path
+
+
+@pytest.fixture
+def anki(anki2_path):
+    with Anki(anki2_path) as anki:
+        yield anki
+
+
+@pytest.fixture
+def model_id(anki):
+    return anki.model_names_and_ids()['Basic']
+
+
+def add_basic_notes(anki, fronts, deck='Default', tags=()):
+    model_id = anki.model_names_and_ids()['Basic']
+    deck_id = anki.deck_names_and_ids().get(deck) or anki.create_deck(deck)
+    return anki.add_notes([{
+        'modelId': model_id,
+        'deckId': deck_id,
+        'fields': {'Front': front, 'Back': 'back'},
+        'tags': list(tags)
+    } for front in fronts])
@@ -0,0 +1,145 @@
+import io
+import os
+import struct
+import zipfile
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+import pytest
+
+from ankisync import apkg
+from ankisync.apkg import Apkg, _copy_member
+
+from tests.conftest import add_basic_notes, basic_model
+
+
+class _Unseekable(io.RawIOBase):
+    def __init__(self, f):
+        self.f = f
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.f.write(b)
+
+
+def _local_extra_ids(path, info):
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        f.seek(name_length, 1)
+        extra = f.read(extra_length)
+
+    ids = []
+    i = 0
+    while i + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[i:i + 4])
+        ids.append(header_id)
+        i += 4 + size
+
+    return ids
+
+
+def _source_zip(path):
+    contents = {
+        'descriptor.txt': b'data descriptor ' * 100,
+        'zip64.txt': os.urandom(300),
+        'stored.png': b'\x89PNG' * 50
+    }
+    with open(path, 'wb') as f:
+        with ZipFile(_Unseekable(f), 'w') as zf:
+            zf.writestr('descriptor.txt', contents['descriptor.txt'], compress_type=ZIP_DEFLATED)
+    with ZipFile(path, 'a') as zf:
+        with zf.open(ZipInfo('zip64.txt'), 'w', force_zip64=True) as f:
+            f.write(contents['zip64.txt'])
+        zf.writestr('stored.png', contents['stored.png'], compress_type=ZIP_STORED)
+
+    return contents
+
+
+@pytest.mark.parametrize('raw', [True, False])
+def test_copied_members_pass_testzip(tmp_path, monkeypatch, raw):
+    # Members above this size get Zip64 records, without writing gigabytes
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 100)
+    if not raw:
+        monkeypatch.setattr(apkg, '_can_copy_raw', lambda dst: False)
+
+    src, dst = str(tmp_path / 'src.zip'), str(tmp_path / 'dst.zip')
+    contents = _source_zip(src)
+    with ZipFile(src) as zs:
+        assert zs.getinfo('descriptor.txt').flag_bits & 0x08
+        with ZipFile(dst, 'w') as zd:
+            zd.writestr('first', b'x')
+            for name in zs.namelist():
+                _copy_member(zs, zd, name)
+
+    with ZipFile(dst) as zd:
+        assert zd.testzip() is None
+        assert {name: zd.read(name) for name in contents} == contents
+        for info in zd.infolist():
+            ids = _local_extra_ids(dst, info)
+            assert len(ids) == len(set(ids))
+
+
+def test_unchanged_media_survive_an_incremental_save(tmp_path):
+    path = str(tmp_path / 'deck.apkg')
+    with Apkg(path) as a:
+        a.init(first_model=basic_model(), first_note_data=False)
+        a.store_media_file('a.png', b'\x89PNG' * 100)
+        a.store_media_file('b.txt', b'text ' * 100)
+
+    with Apkg(path, lazy=True) as a:
+        add_basic_notes(a, ['new'])
+
+    with ZipFile(path) as zf:
+        assert zf.testzip() is None
+    with Apkg(path) as a:
+        assert a.retrieve_media_file('a.png') == b'\x89PNG' * 100
+        assert a.retrieve_media_file('b.txt') == b'text ' * 100
+        assert [n['Front'] for n in a.iter_notes()] == ['new']
+
+
+def test_apkg_writer_streams_notes_and_media(tmp_path):
+    path = str(tmp_path / 'out.apkg')
+    with apkg.ApkgWriter(path, model=basic_model(), chunk_size=100) as w:
+        w.add_media('a.png', b'\x89PNG' * 10)
+        w.add_media('b.txt', io.BytesIO(b'text'))
+        assert w.add_notes({'fields': {'Front': str(i), 'Back': '<img src="a.png">'}} for i in range(250)) == 250
+
+    assert os.listdir(str(tmp_path)) == ['out.apkg']
+    with ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert zf.getinfo('1').compress_type == ZIP_STORED
+    with Apkg(path) as a:
+        assert a.db.Notes.select().count() == a.db.Cards.select().count() == 250
+        assert a.retrieve_media_files(['a.png', 'b.txt']) == {'a.png': b'\x89PNG' * 10, 'b.txt': b'text'}
+        assert a.db.database.pragma('journal_mode') == 'delete'
+
+
+def test_apkg_writer_leaves_nothing_behind_on_error(tmp_path):
+    path = str(tmp_path / 'out.apkg')
+    with pytest.raises(RuntimeError):
+        with apkg.ApkgWriter(path, model=basic_model()) as w:
+            w.add_notes([{'fields': {'Front': 'a'}}])
+            raise RuntimeError
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_edit_is_saved_even_if_the_file_looks_unchanged(tmp_path):
+    path = str(tmp_path / 'deck.apkg')
+    with Apkg(path) as a:
+        a.init(first_model=basic_model(), first_note_data=False)
+        nid, = add_basic_notes(a, ['abc'])
+
+    with Apkg(path) as a:
+        collection = os.path.join(a.temp_dir, 'collection.anki2')
+        stat = os.stat(collection)
+        a.update_notes_fields({nid: {'Front': 'xyz'}})
+        os.utime(collection, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert os.path.getsize(collection) == stat.st_size
+        assert a.is_dirty
+
+    with Apkg(path) as a:
+        assert [n['Front'] for n in a.iter_notes()] == ['xyz']
@@ -0,0 +1,63 @@
+import pytest
+
+from tests.conftest import add_basic_notes
+
+
+@pytest.fixture
+def cards(anki):
+    """
+    1100 notes of one card each, more than SQLite binds in one statement; notes 0, 3, 6... are in deck 'Other'.
+    """
+    note_ids = add_basic_notes(anki, [str(i) for i in range(1100)])
+    card_by_note = dict(anki.db.Cards.select(anki.db.Cards.nid, anki.db.Cards.id).tuples())
+    card_ids = [card_by_note[nid] for nid in note_ids]
+    anki.change_deck_by_id(card_ids[::3], anki.create_deck('Other'))
+
+    return note_ids, card_ids
+
+
+def _query_ids(card_ids):
+    """
+    Input order that is neither sorted nor free of duplicates.
+    """
+    return card_ids[::-1] + card_ids[:5]
+
+
+def test_are_suspended_and_are_due_follow_input_order(anki, cards):
+    _, card_ids = cards
+    anki.suspend(card_ids[1::2])
+    anki.cards_set_next_review([(cid, 2, 2, 10) for cid in card_ids[::5]])
+
+    ids = _query_ids(card_ids)
+    index = {cid: i for i, cid in enumerate(card_ids)}
+    assert anki.are_suspended(ids) == [index[cid] % 2 == 1 and index[cid] % 5 != 0 for cid in ids]
+    assert anki.are_due(ids) == [index[cid] % 5 == 0 for cid in ids]
+
+
+def test_cards_info_and_cards_to_notes(anki, cards):
+    note_ids, card_ids = cards
+    ids = _query_ids(card_ids)
+
+    info = anki.cards_info(ids)
+    assert [i['noteId'] for i in info] == note_ids[::-1] + note_ids[:5]
+    assert info[0]['fields'] == {'Front': '1099', 'Back': 'back'}
+    assert anki.cards_to_notes(ids) == sorted(note_ids)
+
+
+def test_get_decks_groups_in_input_order(anki, cards):
+    _, card_ids = cards
+    ids = _query_ids(card_ids)
+
+    others = set(card_ids[::3])
+
+    decks = anki.get_decks(ids + [1])
+    assert decks['Other'] == [cid for cid in card_ids[::-1] if cid in others]
+    assert decks['Default'] == [cid for cid in card_ids[::-1] if cid not in others]
+
+
+@pytest.mark.parametrize('method', ['are_suspended', 'are_due', 'cards_info'])
+def test_missing_card_raises(anki, cards, method):
+    _, card_ids = cards
+
+    with pytest.raises(anki.db.Cards.DoesNotExist):
+        getattr(anki, method)(card_ids + [1])
@@ -0,0 +1,42 @@
+import pytest
+
+from tests.conftest import add_basic_notes
+
+
+def test_rolled_back_col_write_is_not_cached(anki, model_id):
+    nid, = add_basic_notes(anki, ['a'])
+
+    with pytest.raises(RuntimeError):
+        with anki.db.database.atomic():
+            anki.update_notes_fields({nid: {'Extra': 'e'}})
+            assert anki.model_field_names_by_id(model_id) == ['Front', 'Back', 'Extra']
+            raise RuntimeError
+
+    assert anki.model_field_names_by_id(model_id) == ['Front', 'Back']
+
+    anki.update_notes_fields({nid: {'Back': 'b'}})
+    assert anki.db.Notes.get(id=nid).flds == ['a', 'b']
+
+
+def test_rolled_back_savepoint_is_not_cached(anki, model_id):
+    nid, = add_basic_notes(anki, ['a'])
+
+    with anki.db.database.atomic():
+        anki.model_field_names_by_id(model_id)
+        with pytest.raises(RuntimeError):
+            with anki.db.database.atomic():
+                anki.update_notes_fields({nid: {'Extra': 'e'}})
+                raise RuntimeError
+
+        assert anki.model_field_names_by_id(model_id) == ['Front', 'Back']
+
+
+def test_unchanged_col_is_reused(anki, model_id):
+    anki.model_field_names_by_id(model_id)
+    misses = anki.col_cache.stats()['misses']
+
+    with anki.db.database.atomic():
+        anki.model_field_names_by_id(model_id)
+    anki.model_field_names_by_id(model_id)
+
+    assert anki.col_cache.stats()['misses'] == misses
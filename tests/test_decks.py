@@ -0,0 +1,45 @@
+from ankisync import anki_db
+from ankisync.builder.decks import DeckBuilder
+
+from tests.conftest import add_basic_notes
+
+
+def test_deck_card_counts_handles_preview_and_unknown_queues(anki):
+    add_basic_notes(anki, ['a', 'b', 'c', 'd'])
+    deck_id = anki.deck_names_and_ids()['Default']
+    card_ids = [c.id for c in anki.db.Cards.select(anki.db.Cards.id).order_by(anki.db.Cards.id)]
+    anki.db.Cards.update(queue=4).where(anki.db.Cards.id == card_ids[0]).execute()
+    anki.db.Cards.update(queue=2).where(anki.db.Cards.id == card_ids[1]).execute()
+    anki.db.Cards.update(queue=9).where(anki.db.Cards.id == card_ids[2]).execute()
+
+    assert anki.deck_card_counts([deck_id]) == {
+        deck_id: {'new': 1, 'learning': 1, 'review': 1, 'suspended': 0, 'buried': 0}
+    }
+
+
+def test_delete_more_decks_than_sqlite_variables(anki, model_id):
+    db_col = anki.db.Col.get()
+    db_decks = db_col.decks
+    for i in range(1000):
+        deck = DeckBuilder('D{}'.format(i), dconf=1, id_=anki_db.deck_ids(anki.db.Col).next())
+        db_decks[str(deck.id)] = deck
+    db_col.decks = db_decks
+    anki._save_col(db_col)
+    deck_ids = [anki.deck_names_and_ids()['D{}'.format(i)] for i in range(1000)]
+    kept_id = anki.create_deck('Kept')
+    anki.add_model('Two', ['Front', 'Back'], {'Card 1': ('{{Front}}', '{{Back}}'), 'Card 2': ('{{Back}}', '{{Front}}')})
+    two_id = anki.model_names_and_ids()['Two']
+
+    shared, = anki.add_notes([{'modelId': two_id, 'deckId': deck_ids[-1], 'fields': {'Front': 'shared'}}])
+    first, second = anki.note_to_cards(shared).values()
+    anki.change_deck_by_id([second], kept_id)
+    orphans = anki.add_notes([{'modelId': model_id, 'deckId': did, 'fields': {'Front': str(did)}}
+                              for did in deck_ids[:3]])
+
+    assert anki.delete_decks_by_id(deck_ids, cards_too=True, dry_run=True) == {'decks': 1000, 'cards': 4, 'notes': 3}
+    assert anki.delete_decks_by_id(deck_ids, cards_too=True) == {'decks': 1000, 'cards': 4, 'notes': 3}
+
+    assert [n.id for n in anki.db.Notes.select()] == [shared]
+    assert [(c.id, c.did) for c in anki.db.Cards.select()] == [(second, kept_id)]
+    assert set(anki.deck_names_and_ids()) == {'Default', 'Kept'}
+    assert sorted(g.oid for g in anki.db.Graves.select().where(anki.db.Graves.type == 1)) == sorted(orphans)
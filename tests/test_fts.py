@@ -0,0 +1,40 @@
+from ankisync.anki import Anki
+
+from tests.conftest import add_basic_notes
+
+
+def test_edits_without_fts_are_picked_up(anki2_path):
+    with Anki(anki2_path) as anki:
+        nid, = add_basic_notes(anki, ['apple'])
+        anki.enable_fts()
+        assert anki.search_text('apple') == [nid]
+
+    with Anki(anki2_path) as anki:
+        anki.update_notes_fields({nid: {'Front': 'juice'}})
+
+    with Anki(anki2_path) as anki:
+        anki.enable_fts()
+        assert anki.search_text('juice') == [nid]
+        assert anki.search_text('apple') == []
+
+
+def test_fresh_index_is_not_rebuilt(anki2_path, monkeypatch):
+    with Anki(anki2_path) as anki:
+        nid, = add_basic_notes(anki, ['apple'])
+        anki.enable_fts()
+        anki.update_notes_fields({nid: {'Front': 'juice'}})
+
+    with Anki(anki2_path) as anki:
+        rebuilt = []
+        monkeypatch.setattr('ankisync.fts.FullTextIndex.rebuild', lambda self: rebuilt.append(self))
+        anki.enable_fts()
+        assert rebuilt == []
+        assert anki.search_text('juice') == [nid]
+
+
+def test_blank_query_matches_nothing(anki):
+    add_basic_notes(anki, ['apple'])
+    anki.enable_fts()
+    assert anki.search_text('') == []
+    assert anki.search_text('  ') == []
+    assert anki.fts.search(' ', raw=True) == []
@@ -0,0 +1,39 @@
+import os
+
+from ankisync import anki_db
+from ankisync.anki import Anki
+
+from tests.conftest import add_basic_notes, basic_model
+
+
+def _memory_collection():
+    anki = Anki(':memory:')
+    anki.init(first_model=basic_model(), first_note_data=False)
+    return anki
+
+
+def test_memory_collections_do_not_share_allocators_or_guids():
+    a = _memory_collection()
+    b = _memory_collection()
+
+    assert anki_db.table_ids(a.db.Notes) is not anki_db.table_ids(b.db.Notes)
+    assert anki_db.note_guids(a.db.Notes) is not anki_db.note_guids(b.db.Notes)
+
+    model_id = a.model_names_and_ids()['Basic']
+    a.add_notes([{'modelId': model_id, 'deckId': 1, 'guid': 'same', 'fields': {'Front': 'a'}}])
+    model_id = b.model_names_and_ids()['Basic']
+    b.add_notes([{'modelId': model_id, 'deckId': 1, 'guid': 'same', 'fields': {'Front': 'b'}}])
+
+    assert [n.guid for n in b.db.Notes.select()] == ['same']
+
+
+def test_handles_on_the_same_file_do_not_collide(anki2_path, monkeypatch):
+    monkeypatch.chdir(os.path.dirname(anki2_path))
+
+    with Anki(anki2_path) as a, Anki(os.path.basename(anki2_path)) as b:
+        for _ in range(5):
+            add_basic_notes(a, [str(i) for i in range(50)])
+            add_basic_notes(b, [str(i) for i in range(50)])
+
+        assert a.db.Notes.select().count() == 500
+        assert a.db.Cards.select().count() == 500
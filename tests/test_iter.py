@@ -0,0 +1,69 @@
+import pytest
+
+from ankisync.records import NoteRecord
+
+from tests.conftest import add_basic_notes
+
+
+@pytest.fixture
+def notes(anki):
+    """
+    Seven 'Basic' notes in 'Default' tagged 'even' or 'odd', and two 'Other' notes in 'Food'.
+    """
+    basic = [nid for i in range(7) for nid in add_basic_notes(anki, [str(i)], tags=['even' if i % 2 == 0 else 'odd'])]
+    other_id = anki.add_model('Other', ['Word', 'Meaning'], {'Recognition': ('{{Word}}', '{{Meaning}}'),
+                                                             'Recall': ('{{Meaning}}', '{{Word}}')})
+    food_id = anki.create_deck('Food')
+    other = anki.add_notes([{'modelId': other_id, 'deckId': food_id, 'tags': ['food', 'x'],
+                             'fields': {'Word': w, 'Meaning': m}} for w, m in [('pan', 'bread'), ('mizu', 'water')]])
+
+    return basic, other, other_id, food_id
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 1000])
+def test_iter_notes_pages_through_every_note(anki, notes, batch_size):
+    basic, other, _, _ = notes
+
+    result = list(anki.iter_notes(batch_size=batch_size))
+    assert [n['_nid'] for n in result] == basic + other
+    assert result[0] == {'_nid': basic[0], '_mid': anki.model_names_and_ids()['Basic'],
+                         'Front': '0', 'Back': 'back', '_tags': ['even']}
+    assert result[-1]['Word'] == 'mizu'
+
+
+def test_iter_notes_filters(anki, notes):
+    basic, other, other_id, food_id = notes
+
+    assert [n['_nid'] for n in anki.iter_notes(model_id=other_id, batch_size=1)] == other
+    assert [n['_nid'] for n in anki.iter_notes(deck_id=food_id)] == other
+    assert [n['_nid'] for n in anki.iter_notes(tag='odd', batch_size=2)] == basic[1::2]
+    assert [n['_nid'] for n in anki.iter_notes(tag='foo')] == []
+
+
+def test_iter_notes_as_record(anki, notes):
+    _, other, other_id, _ = notes
+
+    record, _ = anki.iter_notes(model_id=other_id, as_record=True)
+    assert isinstance(record, NoteRecord)
+    assert (record.nid, record.mid, record.fields, record.tags) == \
+        (other[0], other_id, {'Word': 'pan', 'Meaning': 'bread'}, ['food', 'x'])
+
+
+def test_iter_cards_exports_deck_model_template_and_tags(anki, notes):
+    _, _, _, food_id = notes
+
+    rows = list(anki.iter_cards(deck_id=food_id, batch_size=3))
+    assert [(r['Word'], r['template'], r['order']) for r in rows] == \
+        [('pan', 'Recognition', 0), ('pan', 'Recall', 1), ('mizu', 'Recognition', 0), ('mizu', 'Recall', 1)]
+    assert rows[0] == {'Word': 'pan', 'Meaning': 'bread', 'tags': ['food', 'x'], 'deck': 'Food', 'model': 'Other',
+                       'template': 'Recognition', 'order': 0}
+
+    assert len(list(anki.iter_cards(batch_size=2))) == 7 + 4
+
+
+def test_iter_excel_joins_tags(anki, notes):
+    _, _, _, food_id = notes
+
+    row = next(anki.iter_excel(deck_id=food_id))
+    assert row['tags'] == 'food x'
+    assert (row['deck'], row['model']) == ('Food', 'Other')
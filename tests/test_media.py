@@ -0,0 +1,67 @@
+from ankisync.apkg import Apkg
+from ankisync.media import rewrite_media_references
+
+from tests.conftest import basic_model
+
+
+def test_rewrite_media_references():
+    aliases = {'b.png': 'a.png', 'two words.mp3': 'one.mp3'}
+    html = ('<img src="b.png"> <IMG alt=x src=b.png> <img src=\'c.png\'> '
+            '<img src="two%20words.mp3"> [sound:two words.mp3] [sound:b.png.mp3]')
+
+    assert rewrite_media_references(html, aliases) == (
+        '<img src="a.png"> <IMG alt=x src=a.png> <img src=\'c.png\'> '
+        '<img src="one.mp3"> [sound:one.mp3] [sound:b.png.mp3]')
+
+
+def test_duplicate_media_are_stored_once_and_references_rewritten(tmp_path):
+    path = str(tmp_path / 'deck.apkg')
+    with Apkg(path, dedupe_media=True) as a:
+        a.init(first_model=basic_model(), first_note_data=False)
+        model_id = a.model_names_and_ids()['Basic']
+        a.store_media_files({'a.png': b'x' * 100, 'b.png': b'x' * 100, 'c.png': b'y'})
+        nid, = a.add_notes([{'modelId': model_id, 'deckId': 1,
+                             'fields': {'Front': '<img src="b.png">', 'Back': '[sound:c.png]'}}])
+
+        assert a.retrieve_media_file('b.png') == b'x' * 100
+        report = a.media_dedupe_report()
+        assert (report['files'], report['duplicates'], report['bytes_saved']) == (2, 1, 100)
+        assert report['aliases'] == {'b.png': 'a.png'}
+
+    with Apkg(path) as a:
+        assert sorted(a.media.values()) == ['a.png', 'c.png']
+        assert a.db.Notes.get(id=nid).flds == ['<img src="a.png">', '[sound:c.png]']
+
+
+def _package_with_duplicates(path):
+    with Apkg(path) as a:
+        a.init(first_model=basic_model(), first_note_data=False)
+        model_id = a.model_names_and_ids()['Basic']
+        a.store_media_files({'a.jpg': b'x' * 100, 'b.jpg': b'x' * 100})
+        nid, = a.add_notes([{'modelId': model_id, 'deckId': 1, 'fields': {'Front': '<img src="b.jpg">'}}])
+
+    return nid
+
+
+def test_duplicates_already_in_the_package_are_merged_on_save(tmp_path):
+    path = str(tmp_path / 'deck.apkg')
+    nid = _package_with_duplicates(path)
+
+    with Apkg(path, dedupe_media=True):
+        pass
+
+    with Apkg(path) as a:
+        assert list(a.media.values()) == ['a.jpg']
+        assert sorted(a._zip.namelist()) == ['1', 'collection.anki2', 'media']
+        assert a.db.Notes.get(id=nid).flds[0] == '<img src="a.jpg">'
+
+
+def test_duplicates_already_in_the_package_are_reported(tmp_path):
+    path = str(tmp_path / 'deck.apkg')
+    _package_with_duplicates(path)
+
+    with Apkg(path, dedupe_media=True) as a:
+        report = a.media_dedupe_report()
+        assert (report['files'], report['duplicates'], report['bytes_saved']) == (1, 1, 100)
+        assert report['aliases'] == {'b.jpg': 'a.jpg'}
+        assert a.retrieve_media_file('b.jpg') == b'x' * 100
@@ -0,0 +1,68 @@
+import pytest
+
+from ankisync.anki_util import field_checksum
+
+
+def _note(model_id, front, back='back', deck_id=1):
+    return {'modelId': model_id, 'deckId': deck_id, 'fields': {'Front': front, 'Back': back}, 'tags': ['t']}
+
+
+def test_add_notes_writes_notes_and_cards_like_anki(anki, model_id):
+    note_ids = anki.add_notes([_note(model_id, str(i)) for i in range(2500)])
+
+    assert len(note_ids) == len(set(note_ids)) == 2500
+    assert note_ids == sorted(note_ids)
+    note = anki.db.Notes.get(id=note_ids[7])
+    assert (note.flds, note.sfld, note.csum, note.tags) == (['7', 'back'], '7', field_checksum('7'), ['t'])
+    assert len({n.guid for n in anki.db.Notes.select(anki.db.Notes.guid)}) == 2500
+    assert anki.db.Cards.select().count() == 2500
+    assert {c.nid for c in anki.db.Cards.select(anki.db.Cards.nid)} == set(note_ids)
+
+
+def test_guid_fields_make_reimports_idempotent(anki, model_id):
+    first = anki.add_notes([_note(model_id, 'a'), _note(model_id, 'b')], guid_fields=['Front'])
+    again = anki.add_notes([_note(model_id, 'b', back='changed'), _note(model_id, 'c')], guid_fields=['Front'])
+
+    assert again[0] == first[1]
+    assert again[1] not in first
+    assert anki.db.Notes.select().count() == 3
+    assert anki.db.Cards.select().count() == 3
+
+
+def test_update_notes_fields_recomputes_sort_field_and_adds_fields(anki, model_id):
+    a, b = anki.add_notes([_note(model_id, 'a'), _note(model_id, 'b')])
+    anki.enable_fts()
+
+    assert anki.update_notes_fields({a: {'Front': '<i>new</i>', 'Extra': 'e'}, b: {'Back': None}}) == 2
+
+    note = anki.db.Notes.get(id=a)
+    assert (note.flds, note.sfld, note.csum) == (['<i>new</i>', 'back', 'e'], 'new', field_checksum('new'))
+    assert anki.db.Notes.get(id=b).flds == ['b', 'back', '']
+    assert anki.model_field_names_by_id(model_id) == ['Front', 'Back', 'Extra']
+    assert anki.search_text('new') == [a]
+
+
+def test_update_notes_fields_rejects_unknown_notes(anki, model_id):
+    a, = anki.add_notes([_note(model_id, 'a')])
+
+    with pytest.raises(anki.db.Notes.DoesNotExist):
+        anki.update_notes_fields({a: {'Front': 'x'}, a + 1: {'Front': 'y'}})
+
+    assert anki.db.Notes.get(id=a).flds == ['a', 'back']
+
+
+def test_unknown_guid_fields_are_rejected(anki, model_id):
+    with pytest.raises(ValueError, match='front'):
+        anki.add_notes([_note(model_id, str(i)) for i in range(5)], guid_fields=['front'])
+
+    assert anki.db.Notes.select().count() == 0
+
+
+def test_guids_from_fields_differ_between_models(anki, model_id):
+    other_id = anki.add_model('Other', ['Front', 'Back'], {'Card 1': ('{{Front}}', '{{Back}}')})
+
+    basic, = anki.add_notes([_note(model_id, 'a')], guid_fields=['Front'])
+    other, = anki.add_notes([_note(other_id, 'a')], guid_fields=['Front'])
+
+    assert basic != other
+    assert anki.db.Notes.get(id=other).mid == other_id
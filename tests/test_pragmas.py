@@ -0,0 +1,49 @@
+from pathlib import Path
+import sqlite3
+import subprocess
+import sys
+
+from ankisync.anki import Anki
+from ankisync.pragmas import DEFERRED_INDEXES
+
+ROOT = str(Path(__file__).resolve().parent.parent)
+
+
+def _indexes(path):
+    with sqlite3.connect(path) as conn:
+        return {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_indexes_dropped_by_a_crashed_bulk_session_are_recreated(anki2_path):
+    subprocess.run([sys.executable, '-c', (
+        'import os\n'
+        'from ankisync.anki import Anki\n'
+        'Anki({!r}, profile="bulk")\n'
+        'os._exit(0)\n'
+    ).format(anki2_path)], cwd=ROOT, check=True)
+
+    assert not set(DEFERRED_INDEXES['bulk']) & _indexes(anki2_path)
+
+    with Anki(anki2_path):
+        assert set(DEFERRED_INDEXES['bulk']) <= _indexes(anki2_path)
+
+
+def test_unclosed_bulk_session_restores_indexes_at_exit(anki2_path):
+    subprocess.run([sys.executable, '-c', (
+        'from ankisync.anki import Anki\n'
+        'anki = Anki({!r}, profile="bulk")\n'
+    ).format(anki2_path)], cwd=ROOT, check=True)
+
+    assert set(DEFERRED_INDEXES['bulk']) <= _indexes(anki2_path)
+
+
+def test_close_keeps_the_journal_mode_the_collection_was_opened_with(anki2_path):
+    with sqlite3.connect(anki2_path) as conn:
+        conn.execute('PRAGMA journal_mode = wal')
+
+    with Anki(anki2_path) as anki:
+        anki.set_profile('bulk')
+        assert anki.db.database.pragma('journal_mode') == 'delete'
+
+    with sqlite3.connect(anki2_path) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
@@ -0,0 +1,42 @@
+import pytest
+
+from tests.conftest import add_basic_notes
+
+
+def _review(cid, rid, ease=3, type_=1, ivl=1, factor=2500):
+    return dict(id=rid, cid=cid, usn=-1, ease=ease, ivl=ivl, lastIvl=0, factor=factor, time=1000, type=type_)
+
+
+@pytest.fixture
+def card_id(anki):
+    add_basic_notes(anki, ['a'])
+    return anki.db.Cards.get().id
+
+
+def test_colliding_ids_move_to_the_next_free_millisecond(anki, card_id):
+    year = 365 * 86400 * 1000
+    anki.import_reviews([_review(card_id, 5000), _review(card_id, 5002)])
+
+    imported = anki.import_reviews([
+        _review(card_id, 5000 + 3 * year),
+        _review(card_id, 5000),
+        _review(card_id, 5000),
+        _review(card_id, 5000, ease=1, ivl=4),
+        _review(card_id, None, ivl=9, factor=0)
+    ], chunk_size=3)
+
+    ids = [rid for rid, in anki.db.Revlog.select(anki.db.Revlog.id).order_by(anki.db.Revlog.id).tuples()]
+    assert imported == 5
+    assert len(ids) == len(set(ids)) == 7
+    assert ids[:6] == [5000, 5001, 5002, 5003, 5004, 5000 + 3 * year]
+    assert ids[6] > 5000 + 3 * year
+
+    card = anki.db.Cards.get(id=card_id)
+    assert (card.reps, card.lapses, card.ivl, card.factor) == (7, 1, 9, 2500)
+
+
+def test_unknown_card_is_rejected(anki, card_id):
+    with pytest.raises(anki.db.Cards.DoesNotExist):
+        anki.import_reviews([_review(card_id + 1, 1000)])
+
+    assert anki.db.Revlog.select().count() == 0
@@ -0,0 +1,47 @@
+import pytest
+
+from ankisync.schedule import validate_schedule
+
+
+def test_list_rows_are_validated():
+    assert validate_schedule([(1, 2, 2, 10), [2, 0, 0, 5]]) == [(1, 2, 2, 10), (2, 0, 0, 5)]
+    assert validate_schedule([(1, 2, 2, 10, 3, 2500)]) == [(1, 2, 2, 10, 3, 2500)]
+
+    with pytest.raises(ValueError, match='queue'):
+        validate_schedule([(1, 2, 7, 10)])
+    with pytest.raises(ValueError, match='Duplicate'):
+        validate_schedule([(1, 2, 2, 10), (1, 0, 0, 5)])
+    with pytest.raises(ValueError, match='due'):
+        validate_schedule([(1, 2, 2, 1.5)])
+    with pytest.raises(ValueError, match='Expected rows'):
+        validate_schedule([(1, 2, 2)])
+
+
+def test_array_rows_are_validated():
+    np = pytest.importorskip('numpy')
+
+    rows = validate_schedule(np.array([[1, 2, 2, 10, 3, 2500], [2, 0, 0, 5, 0, 0]], dtype=np.int64))
+    assert rows == [[1, 2, 2, 10, 3, 2500], [2, 0, 0, 5, 0, 0]]
+    assert all(type(value) is int for row in rows for value in row)
+
+    with pytest.raises(ValueError, match='type'):
+        validate_schedule(np.array([[1, 5, 2, 10]]))
+    with pytest.raises(ValueError, match='factor'):
+        validate_schedule(np.array([[1, 2, 2, 10, 3, -1]]))
+    with pytest.raises(ValueError, match='Duplicate'):
+        validate_schedule(np.array([[1, 2, 2, 10], [1, 2, 2, 11]]))
+    with pytest.raises(ValueError, match='integers'):
+        validate_schedule(np.array([[1.0, 2, 2, 10]]))
+    with pytest.raises(ValueError, match='shape'):
+        validate_schedule(np.array([1, 2, 2, 10]))
+
+
+def test_array_schedule_is_applied(anki, model_id):
+    np = pytest.importorskip('numpy')
+    anki.add_notes([{'modelId': model_id, 'deckId': 1, 'fields': {'Front': 'a'}}])
+    card_id, = [c.id for c in anki.db.Cards.select(anki.db.Cards.id)]
+
+    assert anki.cards_set_next_review(np.array([[card_id, 2, 2, 30, 7, 2300]])) == 1
+
+    card = anki.db.Cards.get(id=card_id)
+    assert (card.type, card.queue, card.due, card.ivl, card.factor) == (2, 2, 30, 7, 2300)
@@ -0,0 +1,41 @@
+import pytest
+
+from ankisync.search import SearchError
+
+from tests.conftest import add_basic_notes
+
+
+@pytest.fixture
+def notes(anki):
+    cat, dog = add_basic_notes(anki, ['cat', 'dog'], tags=['animal'])
+    cake, = add_basic_notes(anki, ['<b>cake</b>'], deck='Food', tags=['sweet'])
+    return {'cat': cat, 'dog': dog, 'cake': cake}
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('cat', ['cat']),
+    ('ca*', ['cat', 'cake']),
+    ('front:d_g', ['dog']),
+    ('deck:Food', ['cake']),
+    ('tag:animal -cat', ['dog']),
+    ('cat or cake', ['cat', 'cake']),
+    ('(cat or dog) tag:animal', ['cat', 'dog']),
+    ('"deck:Default" -tag:sweet', ['cat', 'dog']),
+    ('is:new', ['cat', 'dog', 'cake'])
+])
+def test_find_notes(anki, notes, query, expected):
+    assert anki.find_notes(query) == sorted(notes[name] for name in expected)
+
+
+def test_find_cards_by_property(anki, notes):
+    card_id = anki.note_to_cards(notes['dog'])['Card 1']
+    anki.cards_set_next_review([(card_id, 2, 2, 10, 20, 2500)])
+
+    assert anki.find_cards('prop:ivl>10') == [card_id]
+    assert anki.find_cards('is:review') == [card_id]
+
+
+@pytest.mark.parametrize('query', ['(cat', '-)', 'cat)', 'tag:', 'dupe:x,y', '-(tag:)'])
+def test_invalid_query_is_rejected(anki, query):
+    with pytest.raises(SearchError):
+        anki.find_notes(query)
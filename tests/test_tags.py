@@ -0,0 +1,55 @@
+from ankisync.anki import Anki
+
+from tests.conftest import add_basic_notes
+
+
+def test_reading_tags_does_not_write_col(anki2_path):
+    with Anki(anki2_path) as anki:
+        add_basic_notes(anki, ['a', 'b'], tags=['x'])
+        db_col = anki.db.Col.get()
+        db_col.tags = dict(db_col.tags, unused=0)
+        anki._save_col(db_col)
+
+    with Anki(anki2_path, profile='read') as anki:
+        col_mod = anki.db.Col.get().mod
+        assert anki.get_tags() == ['x']
+        assert len(anki.note_ids_by_tag('x')) == 2
+        assert anki.db.Col.get().mod == col_mod
+        assert set(anki.db.Col.get().tags) == {'x', 'unused'}
+
+
+def test_new_tags_are_registered(anki):
+    nid, = add_basic_notes(anki, ['a'])
+    anki.get_tags()
+    anki.add_tags([nid], ['y'])
+
+    assert anki.get_tags() == ['y']
+    assert 'y' in anki.db.Col.get().tags
+
+
+def test_bulk_tag_changes_rewrite_only_affected_notes(anki):
+    a, b = add_basic_notes(anki, ['a', 'b'], tags=['x'])
+
+    assert anki.add_tags([a, b], 'X y') == 2
+    assert anki.db.Notes.get(id=a).tags == ['x', 'y']
+    assert anki.remove_tags([a, b], ['Y']) == 2
+    assert anki.remove_tags([a, b], ['y']) == 0
+    assert anki.note_ids_by_tag('x') == [a, b]
+
+    anki.db.Notes.update(mod=0).execute()
+    assert anki.remove_tags([a, b], ['x', 'z']) == 2
+    assert anki.add_tags([a], ['z']) == 1
+    assert [(n.tags, n.mod > 0) for n in anki.db.Notes.select().order_by(anki.db.Notes.id)] == [(['z'], True), ([], True)]
+    anki.db.Notes.update(mod=0).where(anki.db.Notes.id == b).execute()
+    assert anki.add_tags([a], ['z']) == 0
+    assert anki.note_ids_by_tag('z') == [a]
+    assert anki.db.Notes.get(id=b).mod == 0
+
+
+def test_index_notices_tags_added_by_another_handle(anki2_path):
+    with Anki(anki2_path) as a, Anki(anki2_path) as b:
+        assert a.get_tags() == []
+        nid, = add_basic_notes(b, ['a'], tags=['newtag'])
+
+        assert a.get_tags() == ['newtag']
+        assert a.note_ids_by_tag('newtag') == [nid]
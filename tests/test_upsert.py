@@ -0,0 +1,61 @@
+import pytest
+
+from ankisync.anki import Anki
+
+
+def _note(model_id, front, **fields):
+    return {'modelId': model_id, 'deckId': 1, 'fields': dict(fields, Front=front)}
+
+
+def test_failed_chunk_rolls_back_and_job_resumes(anki, model_id):
+    rows = [_note(model_id, 'a', Back='1'), _note(model_id, 'b', Back='2'),
+            _note(model_id, 'a', defaults={'Extra': 'x'}), {'modelId': 404, 'fields': {'Front': 'c'}}]
+    offsets = []
+
+    with pytest.raises(KeyError):
+        anki.upsert_notes(rows, match_fields=['Front'], chunk_size=2, job='import',
+                          progress=lambda p: offsets.append(p['offset']))
+
+    assert offsets == [2]
+    assert anki.model_field_names_by_id(model_id) == ['Front', 'Back']
+    assert anki.db.Notes.select().count() == 2
+
+    rows[3] = _note(model_id, 'c', Back='3')
+    note_ids = anki.upsert_notes(rows, match_fields=['Front'], chunk_size=2, job='import')
+
+    assert len(note_ids) == 2
+    assert anki.model_field_names_by_id(model_id) == ['Front', 'Back', 'Extra']
+    assert sorted(n['Front'] for n in anki.iter_notes()) == ['a', 'b', 'c']
+
+
+def test_changed_input_does_not_match_checkpoint(anki, model_id):
+    anki.upsert_notes([_note(model_id, 'a'), _note(model_id, 'b')], chunk_size=1, job='import')
+
+    with pytest.raises(ValueError):
+        anki.upsert_notes([_note(model_id, 'z'), _note(model_id, 'b')], chunk_size=1, job='import')
+
+
+def test_index_notices_notes_upserted_by_another_handle(anki2_path):
+    with Anki(anki2_path) as a, Anki(anki2_path) as b:
+        model_id = a.model_names_and_ids()['Basic']
+        a.upsert_note(_note(model_id, 'i'), match_fields=['Front'])
+        b.upsert_note(_note(model_id, 'j'), match_fields=['Front'])
+        a.upsert_note(_note(model_id, 'j', Back='again'), match_fields=['Front'])
+
+        assert a.db.Notes.select().count() == 2
+        assert sorted((n['Front'], n['Back']) for n in a.iter_notes()) == [('i', ''), ('j', 'again')]
+
+
+def test_checkpoints_are_kept_out_of_the_collection(anki2_path):
+    with Anki(anki2_path) as anki:
+        model_id = anki.model_names_and_ids()['Basic']
+        rows = [_note(model_id, 'a'), _note(model_id, 'b')]
+        anki.upsert_notes(rows, chunk_size=1, job='import')
+
+    with Anki(anki2_path) as anki:
+        assert 'ankisync_checkpoints' not in anki.db.database.get_tables()
+        assert len(anki.upsert_notes(rows + [_note(model_id, 'c')], chunk_size=1, job='import')) == 1
+        assert sorted(n['Front'] for n in anki.iter_notes()) == ['a', 'b', 'c']
+
+        anki.clear_checkpoint('import')
+        assert anki.checkpoints.get('import') == (0, None)